@@ -0,0 +1,120 @@
+import sys
+import time
+import sqlite3
+import argparse
+import numpy as np
+from prettytable import PrettyTable
+
+# One row per distinct final game of a (variant, level, alpha) configuration, with the policy the
+# top-level search ended with. A game found again, by another seed or run, only adds its seed.
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS games (
+    id INTEGER PRIMARY KEY,
+    variant TEXT NOT NULL,
+    symmetry INTEGER NOT NULL,
+    level INTEGER NOT NULL,
+    alpha REAL NOT NULL,
+    iterations INTEGER NOT NULL,
+    score INTEGER NOT NULL,
+    position_hash TEXT NOT NULL,
+    seeds TEXT NOT NULL,
+    runs INTEGER NOT NULL,
+    moves BLOB NOT NULL,
+    policy_codes BLOB NOT NULL,
+    policy_values BLOB NOT NULL,
+    created REAL NOT NULL,
+    UNIQUE (variant, symmetry, level, alpha, position_hash)
+);
+CREATE INDEX IF NOT EXISTS games_score ON games (variant, level, alpha, score);
+"""
+
+COLUMNS = ['id', 'variant', 'symmetry', 'level', 'alpha', 'iterations', 'score', 'position_hash', 'seeds', 'runs',
+           'moves', 'policy_codes', 'policy_values', 'created']
+
+
+def decode(row):
+    entry = dict(zip(COLUMNS, row))
+    entry['moves'] = np.frombuffer(entry['moves'], dtype=np.uint32)
+    entry['policy_codes'] = np.frombuffer(entry['policy_codes'], dtype=np.int32).astype(np.int64)
+    entry['policy_values'] = np.frombuffer(entry['policy_values'], dtype=np.float64)
+    return entry
+
+
+class Archive:
+    def __init__(self, path):
+        self.path = path
+        self.connection = sqlite3.connect(path, timeout=60)
+        self.connection.executescript(SCHEMA)
+
+    def close(self):
+        self.connection.close()
+
+    def add(self, variant, symmetry, level, alpha, iterations, seed, moves, position_hash, strategy):
+        # Returns True when the game is new to the archive for this configuration.
+        codes, values, _ = strategy.entries()
+        with self.connection:
+            row = self.connection.execute(
+                "SELECT id, seeds FROM games WHERE variant = ? AND symmetry = ? AND level = ? AND alpha = ? "
+                "AND position_hash = ?", (variant, int(symmetry), level, alpha, position_hash)).fetchone()
+            if row is not None:
+                seeds = row[1].split(',')
+                if str(seed) not in seeds:
+                    seeds.append(str(seed))
+                self.connection.execute("UPDATE games SET runs = runs + 1, seeds = ? WHERE id = ?",
+                                        (','.join(seeds), row[0]))
+                return False
+            self.connection.execute(
+                f"INSERT INTO games ({', '.join(COLUMNS[1:])}) VALUES ({', '.join('?' * (len(COLUMNS) - 1))})",
+                (variant, int(symmetry), level, alpha, iterations, len(moves), position_hash, str(seed), 1,
+                 np.asarray(moves, dtype=np.uint32).tobytes(), codes.astype(np.int32).tobytes(),
+                 np.asarray(values, dtype=np.float64).tobytes(), time.time()))
+            return True
+
+    def best(self, symmetry=None):
+        # Highest-scoring game, the most recent one on ties; with `symmetry`, only games whose policy
+        # codes were computed with (True) or without (False) the symmetry layer.
+        query = f"SELECT {', '.join(COLUMNS)} FROM games"
+        parameters = ()
+        if symmetry is not None:
+            query += " WHERE symmetry = ?"
+            parameters = (int(symmetry),)
+        row = self.connection.execute(query + " ORDER BY score DESC, created DESC LIMIT 1", parameters).fetchone()
+        return decode(row) if row is not None else None
+
+    def entries(self, limit):
+        rows = self.connection.execute(f"SELECT {', '.join(COLUMNS)} FROM games ORDER BY score DESC, created DESC "
+                                       f"LIMIT ?", (limit,)).fetchall()
+        return [decode(row) for row in rows]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='List the games of a best-game archive')
+    parser.add_argument('path', type=str, help='Archive file written by main.py --archive')
+    parser.add_argument('--limit', type=int, default=20, help='Games listed, best first')
+    parser.add_argument('--moves', type=int, default=None, help='Print the moves of the game with this id')
+    args = parser.parse_args()
+
+    archive = Archive(args.path)
+    entries = archive.entries(args.limit if args.moves is None else -1)
+    archive.close()
+    if args.moves is not None:
+        for entry in entries:
+            if entry['id'] == args.moves:
+                sys.stdout.write(' '.join(str(move) for move in entry['moves'].tolist()) + '\n')
+                return
+        sys.stderr.write(f"No game with id {args.moves}\n")
+        exit(1)
+
+    table = PrettyTable()
+    table.field_names = ["Id", "Variant", "Symmetry", "Level", "Alpha", "Iterations", "Score", "Position hash", "Runs",
+                         "Seeds", "Policy entries", "Created"]
+    for entry in entries:
+        table.add_row([entry['id'], entry['variant'], 'yes' if entry['symmetry'] else 'no', entry['level'],
+                       entry['alpha'], entry['iterations'], entry['score'], entry['position_hash'], entry['runs'],
+                       entry['seeds'], len(entry['policy_codes']),
+                       time.strftime('%Y-%m-%d %H:%M', time.localtime(entry['created']))])
+    print(table.get_string())
+
+
+if __name__ == "__main__":
+    main()
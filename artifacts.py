@@ -0,0 +1,41 @@
+import zipfile
+import numpy as np
+
+
+def artifact_path(prefix, level):
+    return f"{prefix}.level{level}.npz"
+
+
+class ArtifactWriter:
+    # Run artifacts of one level: after each committed move, the game so far and the non-zero
+    # policy entries. Snapshot i is appended to the archive as its own members moves_i,
+    # policy_codes_i and policy_values_i, so each move writes only its own snapshot; the first
+    # snapshot starts a new archive with the run parameters.
+    def __init__(self, path, level, iterations, alpha, seed):
+        self.path = path
+        self.run = np.array([level, iterations, alpha, seed], dtype=float)
+        self.count = 0
+
+    def snapshot(self, sequence, strategy):
+        codes, values, _ = strategy.entries()
+        arrays = {f'moves_{self.count}': np.asarray(sequence, dtype=np.uint32),
+                  f'policy_codes_{self.count}': codes.astype(np.int32),
+                  f'policy_values_{self.count}': np.asarray(values, dtype=np.float64)}
+        if self.count == 0:
+            arrays['run'] = self.run
+        with zipfile.ZipFile(self.path, 'w' if self.count == 0 else 'a', zipfile.ZIP_DEFLATED) as archive:
+            for name, array in arrays.items():
+                with archive.open(f"{name}.npy", 'w', force_zip64=True) as member:
+                    np.lib.format.write_array(member, array)
+        self.count += 1
+
+
+def snapshot_count(data):
+    return sum(name.startswith('moves_') for name in data.files)
+
+
+def load_snapshots(path):
+    # (packed moves, policy codes, policy values) of every snapshot, oldest first.
+    with np.load(path) as data:
+        return [(data[f'moves_{i}'], data[f'policy_codes_{i}'].astype(np.int64), data[f'policy_values_{i}'])
+                for i in range(snapshot_count(data))]
@@ -5,22 +5,43 @@ MAX_GRID_SIZE = 64
 MAX_HISTORY_SIZE = 1000
 MAX_LEGAL_MOVES = 1000
 MAX_POLICY_SIZE = 7000
+SCAN_MARGIN = 4
+EMPTY_BOUNDS = (MAX_GRID_SIZE, -1, MAX_GRID_SIZE, -1)
+
+# Cell bits fit in 9 bits, packed moves below 640000, priorities, slots and codes below 17000.
+# Signed types keep arithmetic on unpacked coordinates free of unsigned wrap-around.
+CELL_DTYPE = np.int16
+MOVE_DTYPE = np.int32
+SLOT_DTYPE = np.int16
 
 
 class Grid:
+    __slots__ = ('move_history_count', 'grid', 'history', 'move_count', 'moves', 'priority', 'dominator', 'code',
+                 'hash', 'bounds', 'marks')
+
     def __init__(self):
+        self.grid = np.zeros((MAX_GRID_SIZE, MAX_GRID_SIZE), dtype=CELL_DTYPE)
+        self.history = np.zeros(MAX_HISTORY_SIZE, dtype=MOVE_DTYPE)
+        self.moves = np.zeros(MAX_LEGAL_MOVES, dtype=MOVE_DTYPE)
+        self.priority = np.zeros(MAX_LEGAL_MOVES, dtype=SLOT_DTYPE)
+        self.dominator = np.zeros(MAX_LEGAL_MOVES, dtype=SLOT_DTYPE)
+        self.code = np.zeros(MAX_LEGAL_MOVES, dtype=SLOT_DTYPE)
+        self.reset()
+
+    def reset(self):
         self.move_history_count = 0
-        self.grid = np.zeros((MAX_GRID_SIZE, MAX_GRID_SIZE), dtype=int)
-        self.history = np.zeros(MAX_HISTORY_SIZE, dtype=int)
+        self.grid.fill(0)
         self.move_count = 0
-        self.moves = np.zeros(MAX_LEGAL_MOVES, dtype=int)
-        self.priority = np.zeros(MAX_LEGAL_MOVES, dtype=int)
-        self.dominator = np.full(MAX_LEGAL_MOVES, 999, dtype=int)
-        self.code = np.zeros(MAX_LEGAL_MOVES, dtype=int)
+        self.dominator.fill(999)
+        self.hash = 0
+        self.bounds = EMPTY_BOUNDS
+        self.marks = {}
 
     def copy(self):
-        new_grid = Grid()
+        new_grid = Grid.__new__(Grid)
         new_grid.move_history_count = self.move_history_count
+        new_grid.hash = self.hash
+        new_grid.bounds = self.bounds
         new_grid.grid = self.grid.copy()
         new_grid.history = self.history.copy()
         new_grid.move_count = self.move_count
@@ -28,12 +49,128 @@ class Grid:
         new_grid.priority = self.priority.copy()
         new_grid.dominator = self.dominator.copy()
         new_grid.code = self.code.copy()
+        new_grid.marks = {}
         return new_grid
 
+    def copy_from(self, source):
+        self.move_history_count = source.move_history_count
+        self.hash = source.hash
+        self.bounds = source.bounds
+        np.copyto(self.grid, source.grid)
+        np.copyto(self.history, source.history)
+        self.move_count = source.move_count
+        np.copyto(self.moves, source.moves)
+        np.copyto(self.priority, source.priority)
+        np.copyto(self.dominator, source.dominator)
+        np.copyto(self.code, source.code)
+        self.marks = {}
+
+
+class GridPool:
+    # Boards handed back with release() are reset or overwritten in place by the next acquire(),
+    # so temporary boards do not allocate a new set of arrays each time.
+    def __init__(self, grid_type):
+        self.grid_type = grid_type
+        self.free = []
+        self.allocated = 0
+
+    def acquire(self, source=None):
+        if self.free:
+            grid = self.free.pop()
+            if source is None:
+                grid.reset()
+        else:
+            grid = self.grid_type()
+            self.allocated += 1
+        if source is not None:
+            grid.copy_from(source)
+        return grid
+
+    def release(self, grid):
+        self.free.append(grid)
+
+
+class Sequence:
+    # Compact search result: the packed moves of a whole game from the initial cross, its score
+    # and the Zobrist hash of the final position (grid.hash). Boards are rebuilt with construct_game.
+    def __init__(self, moves):
+        self.moves = np.asarray(moves, dtype=np.uint32)
+        self.score = len(self.moves)
+        self.signature = position_hash(self.moves)
+
+
+def mix64(values):
+    z = np.asarray(values, dtype=np.uint64) + np.uint64(0x9E3779B97F4A7C15)
+    z = (z ^ (z >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    z = (z ^ (z >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return z ^ (z >> np.uint64(31))
+
+
+def zobrist_keys(moves):
+    # Zobrist keys of packed moves: a move adds its point and its line, so its key XORs one key per
+    # cell and one per (start cell, direction). Equal boards get equal hashes whatever the move order.
+    moves = np.asarray(moves, dtype=np.int64)
+    direction = unpack_direction(moves)
+    cell = unpack_x(moves) * MAX_GRID_SIZE + unpack_y(moves)
+    step = np.array([1, MAX_GRID_SIZE + 1, MAX_GRID_SIZE, MAX_GRID_SIZE - 1])[direction]
+    start = cell + (unpack_k(moves) - 4) * step
+    return mix64(cell) ^ mix64(MAX_GRID_SIZE * MAX_GRID_SIZE + start * 4 + direction)
+
+
+def zobrist_key(move):
+    return int(zobrist_keys([move])[0])
+
+
+def position_hash(moves):
+    return int(np.bitwise_xor.reduce(zobrist_keys(np.atleast_1d(moves)), initial=np.uint64(0)))
+
+
+def cell_bounds(cells):
+    # (min_x, max_x, min_y, max_y) of the occupied cells.
+    xs, ys = np.nonzero(cells & 1)
+    if len(xs) == 0:
+        return MAX_GRID_SIZE, -1, MAX_GRID_SIZE, -1
+    return int(xs.min()), int(xs.max()), int(ys.min()), int(ys.max())
+
+
+def extend_bounds(bounds, x, y):
+    min_x, max_x, min_y, max_y = bounds
+    return min(min_x, int(x)), max(max_x, int(x)), min(min_y, int(y)), max(max_y, int(y))
+
+
+def scan_box(grid, low=1, high=MAX_GRID_SIZE - 2):
+    # Full scans only visit the bounding box of the occupied cells plus SCAN_MARGIN, clipped to
+    # [low, high]: every move point and every drawn segment lies within one cell of a dot.
+    min_x, max_x, min_y, max_y = grid.bounds
+    return max(min_x - SCAN_MARGIN, low), min(max_x + SCAN_MARGIN, high), \
+        max(min_y - SCAN_MARGIN, low), min(max_y + SCAN_MARGIN, high)
+
+
+edge_reported = False
+
+
+def report_edge():
+    global edge_reported
+    if not edge_reported:
+        logging.warning("Board edge reached: moves within two cells of the border are not generated")
+        edge_reported = True
+
+
+def on_edge(x, y):
+    # Move points must stay two cells inside the board on every side. The original search_moves
+    # only stopped at x or y == 1; the upper margin was added to match it. No game reaches it: the
+    # start cross spans cells 14-23, and search_moves_optimized, which indexes five cells past the
+    # played point unchecked, would already fail on a move at 59.
+    if 1 < x < MAX_GRID_SIZE - 2 and 1 < y < MAX_GRID_SIZE - 2:
+        return False
+    report_edge()
+    return True
+
 
 def initialize_game(grid):
     logging.info("Initializing game")
     grid.move_history_count = 0
+    grid.hash = 0
     grid.grid.fill(0)
     grid.grid[31, 34:38] = 1
     grid.grid[32, [34, 37]] = 1
@@ -47,23 +184,27 @@ def initialize_game(grid):
     grid.grid[40, 34:38] = 1
 
     delta = (MAX_GRID_SIZE - 30) // 2
-    for i in range(MAX_GRID_SIZE):
-        for j in range(MAX_GRID_SIZE):
-            if i > delta and j > delta:
-                grid.grid[i - delta, j - delta] = grid.grid[i, j]
-                grid.grid[i, j] = 0
+    grid.bounds = cell_bounds(grid.grid)
+    min_x, max_x, min_y, max_y = scan_box(grid, 0, MAX_GRID_SIZE - 1)
+    for i in range(max(min_x, delta + 1), max_x + 1):
+        for j in range(max(min_y, delta + 1), max_y + 1):
+            grid.grid[i - delta, j - delta] = grid.grid[i, j]
+            grid.grid[i, j] = 0
+    grid.bounds = cell_bounds(grid.grid)
     logging.info("Game initialized")
     return 0
 
 
 def display_game(grid, file):
     logging.info("Displaying game")
+    cells = grid.grid
     total = 0
     min_x, max_x = MAX_GRID_SIZE, 0
     min_y, max_y = MAX_GRID_SIZE, 0
-    for i in range(1, MAX_GRID_SIZE):
-        for j in range(1, MAX_GRID_SIZE):
-            if grid.grid[i, j] not in [0, 512]:
+    box_min_x, box_max_x, box_min_y, box_max_y = scan_box(grid, 1, MAX_GRID_SIZE - 1)
+    for i in range(box_min_x, box_max_x + 1):
+        for j in range(box_min_y, box_max_y + 1):
+            if cells[i, j] not in [0, 512]:
                 total += 1
                 if i > max_x:
                     max_x = i
@@ -87,27 +228,27 @@ def display_game(grid, file):
         j = MAX_GRID_SIZE - jj - 1
         line1, line2, line3, line4, line5 = "    | ", "    | ", f"{j:03d} | ", "    | ", "    | "
         for i in range(min_x, max_x + 1):
-            if grid.grid[i, j] & 256:
+            if cells[i, j] & 256:
                 line1 += "\\ "
                 line2 += " \\"
             else:
                 line1 += "  "
                 line2 += "  "
-            if grid.grid[i, j] & 2:
+            if cells[i, j] & 2:
                 line1 += "|"
                 line2 += "|"
             else:
                 line1 += " "
                 line2 += " "
-            if grid.grid[i, j] & 4:
+            if cells[i, j] & 4:
                 line1 += " /"
                 line2 += "/ "
             else:
                 line1 += "  "
                 line2 += "  "
-            line3 += "-" if grid.grid[i, j] & 128 else " "
-            value = " ? " if grid.grid[i, j] % 2 == 0 and grid.grid[i, j] > 0 else "   "
-            if grid.grid[i, j] % 2 == 1:
+            line3 += "-" if cells[i, j] & 128 else " "
+            value = " ? " if cells[i, j] % 2 == 0 and cells[i, j] > 0 else "   "
+            if cells[i, j] % 2 == 1:
                 value = "xxx"
                 for ii in range(grid.move_history_count):
                     if i == unpack_x(grid.history[ii]) and j == unpack_y(grid.history[ii]):
@@ -115,20 +256,20 @@ def display_game(grid, file):
                 if value == "xxx":
                     value = " + "
             line3 += value
-            line3 += "-" if grid.grid[i, j] & 8 else " "
-            if grid.grid[i, j] & 64:
+            line3 += "-" if cells[i, j] & 8 else " "
+            if cells[i, j] & 64:
                 line4 += " /"
                 line5 += "/ "
             else:
                 line4 += "  "
                 line5 += "  "
-            if grid.grid[i, j] & 32:
+            if cells[i, j] & 32:
                 line4 += "|"
                 line5 += "|"
             else:
                 line4 += " "
                 line5 += " "
-            if grid.grid[i, j] & 16:
+            if cells[i, j] & 16:
                 line4 += "\\ "
                 line5 += " \\"
             else:
@@ -185,8 +326,9 @@ def play_move(source_grid, target_grid, move_index):
     dirO = [32, 64, 128, 256]
     dirDO = [34, 68, 136, 272]
 
-    if source_grid != target_grid:
-        target_grid.grid = np.copy(source_grid.grid)
+    if source_grid is not target_grid:
+        np.copyto(target_grid.grid, source_grid.grid)
+        target_grid.bounds = source_grid.bounds
         target_grid.move_history_count = source_grid.move_history_count
         target_grid.history[:target_grid.move_history_count] = source_grid.history[:target_grid.move_history_count]
 
@@ -195,6 +337,7 @@ def play_move(source_grid, target_grid, move_index):
 
     target_grid.history[target_grid.move_history_count] = source_grid.moves[move_index]
     target_grid.move_history_count += 1
+    target_grid.hash = source_grid.hash ^ zobrist_key(source_grid.moves[move_index])
 
     if target_grid.move_history_count > MAX_HISTORY_SIZE:
         raise ValueError("Move history storage table too small")
@@ -207,6 +350,7 @@ def play_move(source_grid, target_grid, move_index):
     moveDirection = unpack_direction(source_grid.moves[move_index])
     moveK = unpack_k(source_grid.moves[move_index])
     target_grid.grid[moveX, moveY] = 1
+    target_grid.bounds = extend_bounds(target_grid.bounds, moveX, moveY)
     for uu in range(-4, 1):
         alpha = moveK + uu
         ii = moveX + (alpha * dirX[moveDirection])
@@ -229,8 +373,9 @@ def search_moves(grid):
     dirDO = [34, 68, 136, 272]
 
     grid.move_count = 0
-    for i in range(1, MAX_GRID_SIZE - 1):
-        for j in range(1, MAX_GRID_SIZE - 1):
+    min_x, max_x, min_y, max_y = scan_box(grid)
+    for i in range(min_x, max_x + 1):
+        for j in range(min_y, max_y + 1):
             if grid.grid[i, j] == 0:
                 if (grid.grid[i - 1, j - 1] + grid.grid[i - 1, j] + grid.grid[i - 1, j + 1] + grid.grid[i, j - 1] +
                     grid.grid[i, j + 1] + grid.grid[i + 1, j - 1] + grid.grid[i + 1, j] + grid.grid[i + 1, j + 1]) != 0:
@@ -258,7 +403,7 @@ def search_moves(grid):
                                 for kk in range(5):
                                     if k + kk != 7 and (tab[k + kk] & 1):
                                         total += 1
-                                if total == 9:
+                                if total == 9 and not on_edge(i, j):
                                     moveX = i
                                     moveY = j
                                     moveDirection = direction
@@ -282,8 +427,6 @@ def search_moves(grid):
                                     grid.move_count += 1
                                     if grid.move_count > MAX_HISTORY_SIZE:
                                         raise ValueError("Move table too small")
-                                    if i in [1, MAX_GRID_SIZE - 1] or j in [1, MAX_GRID_SIZE - 1]:
-                                        raise ValueError("Grid too small: move found on edge")
     update_dominator(grid)
 
 
@@ -343,10 +486,10 @@ def search_moves_optimized(grid_a, grid_b, played_move):
                 grid_b.dominator[grid_b.move_count] = 999
                 grid_b.move_count += 1
 
-    moveX = unpack_x(grid_a.moves[played_move])
-    moveY = unpack_y(grid_a.moves[played_move])
-    for i in range(moveX - 4, moveX + 5):
-        for j in range(moveY - 4, moveY + 5):
+    playedX = unpack_x(grid_a.moves[played_move])
+    playedY = unpack_y(grid_a.moves[played_move])
+    for i in range(playedX - 4, playedX + 5):
+        for j in range(playedY - 4, playedY + 5):
             if grid_b.grid[i, j] == 0 and i > 0 and j > 0 and i < MAX_GRID_SIZE and j < MAX_GRID_SIZE:
                 if grid_b.grid[i - 1, j - 1] + grid_b.grid[i - 1, j] + grid_b.grid[i - 1, j + 1] + grid_b.grid[
                     i, j - 1] + grid_b.grid[i, j + 1] + grid_b.grid[i + 1, j - 1] + grid_b.grid[i + 1, j] + grid_b.grid[
@@ -375,7 +518,7 @@ def search_moves_optimized(grid_a, grid_b, played_move):
                                 for kk in range(5):
                                     if k + kk != 7 and (tab[k + kk] & 1):
                                         total += 1
-                                if total == 9:
+                                if total == 9 and not on_edge(i, j):
                                     res = 0
                                     for xx in range(grid_b.move_count):
                                         moveX = unpack_x(grid_b.moves[xx])
@@ -408,23 +551,143 @@ def search_moves_optimized(grid_a, grid_b, played_move):
                                         grid_b.move_count += 1
                                         if grid_b.move_count > MAX_HISTORY_SIZE:
                                             raise ValueError("Move table too small")
-                                        if i in [1, MAX_GRID_SIZE - 1] or j in [1, MAX_GRID_SIZE - 1]:
-                                            raise ValueError("Grid too small: move found on edge")
     update_dominator(grid_b)
 
 
-def construct_game(max_grid, init_grid, level, file):
-    node = init_grid.copy()
-    for i in range(level):
+def play(grid, move_index):
+    previous = Grid.__new__(Grid)
+    previous.move_count = grid.move_count
+    previous.moves = grid.moves[:grid.move_count].copy()
+    play_move(grid, grid, move_index)
+    search_moves_optimized(previous, grid, move_index)
+
+
+def save_moves(grid):
+    count = grid.move_count
+    return count, grid.moves[:count].copy(), grid.priority[:count].copy(), grid.dominator[:count].copy(), \
+        grid.code[:count].copy()
+
+
+def restore_moves(grid, saved):
+    count, moves, priority, dominator, code = saved
+    grid.move_count = count
+    grid.moves[:count] = moves
+    grid.priority[:count] = priority
+    grid.dominator[:count] = dominator
+    grid.code[:count] = code
+
+
+def mark(grid):
+    grid.marks[grid.move_history_count] = save_moves(grid)
+    return grid.move_history_count
+
+
+def unplay(grid, depth):
+    dirX = [0, 1, 1, 1]
+    dirY = [1, 1, 0, -1]
+    dirD = [2, 4, 8, 16]
+    dirO = [32, 64, 128, 256]
+    dirDO = [34, 68, 136, 272]
+
+    while grid.move_history_count > depth:
+        grid.move_history_count -= 1
+        move = grid.history[grid.move_history_count]
+        grid.hash ^= zobrist_key(move)
+        moveX = unpack_x(move)
+        moveY = unpack_y(move)
+        moveDirection = unpack_direction(move)
+        moveK = unpack_k(move)
+        for uu in range(-4, 1):
+            alpha = moveK + uu
+            ii = moveX + (alpha * dirX[moveDirection])
+            jj = moveY + (alpha * dirY[moveDirection])
+            if uu == -4:
+                grid.grid[ii, jj] -= dirD[moveDirection]
+            if uu == 0:
+                grid.grid[ii, jj] -= dirO[moveDirection]
+            if uu in [-3, -2, -1]:
+                grid.grid[ii, jj] -= dirDO[moveDirection]
+        grid.grid[moveX, moveY] = 0
+    grid.bounds = cell_bounds(grid.grid)
+    for marked in [marked for marked in grid.marks if marked > depth]:
+        del grid.marks[marked]
+    if depth in grid.marks:
+        restore_moves(grid, grid.marks[depth])
+    else:
+        search_moves(grid)
+
+
+def generate(grid, log_file):
+    dirX = [0, 1, 1, 1]
+    dirY = [1, 1, 0, -1]
+    dirD = [2, 4, 8, 16]
+    dirO = [32, 64, 128, 256]
+    dirDO = [34, 68, 136, 272]
+
+    cells = grid.grid
+    for i in range(grid.move_count):
+        move_x = unpack_x(grid.moves[i])
+        move_y = unpack_y(grid.moves[i])
+        move_d = unpack_direction(grid.moves[i])
+        move_k = unpack_k(grid.moves[i])
+
+        end_x1 = move_x + move_k * dirX[move_d]
+        end_y1 = move_y + move_k * dirY[move_d]
+        start_x2 = move_x + (move_k - 4) * dirX[move_d]
+        start_y2 = move_y + (move_k - 4) * dirY[move_d]
+
+        n1 = (MAX_GRID_SIZE - 1) * end_y1 + end_x1
+        n2 = (MAX_GRID_SIZE - 1) * start_y2 + start_x2
+
+        if n1 < n2:
+            grid_code = 4 * n1
+            if end_x1 < start_x2:
+                grid_code += 0
+            elif end_x1 == start_x2:
+                grid_code += 1
+            else:
+                if end_y1 > start_y2:
+                    grid_code += 2
+                else:
+                    grid_code += 3
+        else:
+            grid_code = 4 * n2
+            if start_x2 < end_x1:
+                grid_code += 0
+            elif start_x2 == end_x1:
+                grid_code += 1
+            else:
+                if start_y2 > end_y1:
+                    grid_code += 2
+                else:
+                    grid_code += 3
+
+        for direction in range(4):
+            if move_d == direction:
+                if (cells[end_y1, end_x1] & dirD[direction]) or (cells[start_y2, start_x2] & dirD[direction]):
+                    grid_code += dirDO[direction]
+                if (cells[end_y1, end_x1] & dirO[direction]) or (cells[start_y2, start_x2] & dirO[direction]):
+                    grid_code += dirD[direction]
+        grid.code[i] = grid_code
+
+
+def display_sequence(sequence, file):
+    for i, move in enumerate(sequence):
+        file.write(f"move {i + 1:02d} {move} x={unpack_x(move)} y={unpack_y(move)} d={unpack_direction(move)} k={unpack_k(move)} \n")
+
+
+def construct_game(sequence, init_grid, level, file):
+    node = pool.acquire(init_grid)
+    for i in range(init_grid.move_history_count, level):
         search_moves(node)
         j0 = 999
         for j in range(node.move_count):
-            if node.moves[j] == max_grid.history[i]:
+            if node.moves[j] == sequence[i]:
                 j0 = j
         if j0 == 999:
             logging.error(f"Move from max_grid {i} not found. Something is wrong")
             file.write("BEST\n")
-            display_game(max_grid, file)
+            display_sequence(sequence, file)
             file.write("NODE\n")
             display_game(node, file)
             file.close()
@@ -440,3 +703,5 @@ def move_to_index(move):
     k = unpack_k(move)
     return x * MAX_GRID_SIZE * MAX_GRID_SIZE * MAX_GRID_SIZE + y * MAX_GRID_SIZE * MAX_GRID_SIZE + direction * MAX_GRID_SIZE + k
 
+
+pool = GridPool(Grid)
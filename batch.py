@@ -0,0 +1,192 @@
+import numpy as np
+
+import base
+import movetable
+import symmetry
+from base import MAX_GRID_SIZE, MAX_HISTORY_SIZE, Sequence
+from movetable import MOVE_COUNT, packed_to_id
+
+# Lockstep playouts: the boards of all running playouts live in one (N, 64 * 64 + 1) cell array
+# (array-engine bits, plus an always-empty cell used for points off the board) and their legal
+# moves in (N, W) arrays of dense move ids sorted by id, padded with MOVE_COUNT. Every table below
+# has one extra, always illegal row at MOVE_COUNT so the padding can be gathered like a move.
+CELL_COUNT = MAX_GRID_SIZE * MAX_GRID_SIZE
+PADDING = MOVE_COUNT
+WINDOW_OFFSETS = np.arange(-4, 8)
+
+
+def extend(table, value):
+    return np.concatenate([table, np.full((1,) + table.shape[1:], value, dtype=table.dtype)])
+
+
+def line_cells(start_x, start_y, directions, offsets):
+    x = start_x[:, None] + offsets[None, :] * movetable.DIR_X[directions][:, None]
+    y = start_y[:, None] + offsets[None, :] * movetable.DIR_Y[directions][:, None]
+    on_board = (x >= 0) & (x < MAX_GRID_SIZE) & (y >= 0) & (y < MAX_GRID_SIZE)
+    return np.where(on_board, x * MAX_GRID_SIZE + y, CELL_COUNT)
+
+
+def affected_moves(points_x, points_y, directions, offsets):
+    # Ids of the moves of each given direction whose move point lies offsets[:, k] points from the
+    # given point along that direction, for k in 0..4; PADDING where a move leaves the board.
+    shape = (len(points_x),) + offsets.shape
+    x = points_x[:, None, None] + offsets[None] * movetable.DIR_X[directions][:, None, None]
+    y = points_y[:, None, None] + offsets[None] * movetable.DIR_Y[directions][:, None, None]
+    d = np.broadcast_to(directions[:, None, None], shape)
+    k = np.broadcast_to(np.arange(5), shape)
+    on_board = (x >= 0) & (x < MAX_GRID_SIZE) & (y >= 0) & (y < MAX_GRID_SIZE)
+    ids = movetable.move_id(np.where(on_board, x, 0), np.where(on_board, y, 0), d, k)
+    ids = np.where(on_board & movetable.MOVE_VALID[ids], ids, PADDING)
+    return ids.reshape(len(points_x), -1).astype(np.int32)
+
+
+_valid = movetable.MOVE_VALID
+SPAN_CELLS = extend(np.where(_valid[:, None], movetable.MOVE_CELLS, CELL_COUNT), CELL_COUNT)
+WINDOW_CELLS = extend(np.where(_valid[:, None], line_cells(movetable.MOVE_START_X, movetable.MOVE_START_Y,
+                                                          movetable.MOVE_DIRECTION, WINDOW_OFFSETS), CELL_COUNT),
+                      CELL_COUNT)
+HOLE_PATTERN = extend(np.arange(5)[None, :] != (4 - movetable.MOVE_K)[:, None], True)
+CELL_BITS = extend(movetable.MOVE_CELL_BITS, 0)
+MASK_D = extend(movetable.MOVE_MASK_D, 0)
+MASK_O = extend(movetable.MOVE_MASK_O, 0)
+MASK_DO = extend(movetable.MOVE_MASK_DO, 0)
+BASE_CODE = extend(movetable.MOVE_BASE_CODE, 0)
+END_READ = extend(movetable.MOVE_END_READ, CELL_COUNT)
+START_READ = extend(movetable.MOVE_START_READ, CELL_COUNT)
+POINT = extend(movetable.MOVE_CELL, CELL_COUNT)
+PACKED = extend(movetable.MOVE_PACKED, 0)
+INNER = extend((movetable.MOVE_X > 1) & (movetable.MOVE_Y > 1) & (movetable.MOVE_X < MAX_GRID_SIZE - 2) &
+               (movetable.MOVE_Y < MAX_GRID_SIZE - 2), True)
+
+# Moves that can become legal or change priority when a move is played, besides the current
+# ones: moves using the new point as one of their four supports (per cell, all directions), and
+# moves on the played line starting at most 7 points from its start, whose segment window
+# overlaps the four new segments (per start cell and direction).
+_cells = np.arange(CELL_COUNT)
+_k = np.arange(5)
+SUPPORT_OFFSETS = np.array([[-offset for offset in range(k - 4, k + 1) if offset] for k in range(5)]).T
+WINDOW_STARTS = np.arange(-7, 8)[:, None] + 4 - _k[None, :]
+POINT_AFFECTED = np.concatenate([affected_moves(_cells // MAX_GRID_SIZE, _cells % MAX_GRID_SIZE,
+                                                np.full(CELL_COUNT, d), SUPPORT_OFFSETS) for d in range(4)], axis=1)
+_keys = np.arange(CELL_COUNT * 4)
+LINE_AFFECTED = affected_moves(_keys // 4 // MAX_GRID_SIZE, _keys // 4 % MAX_GRID_SIZE, _keys % 4, WINDOW_STARTS)
+LINE_KEY = extend(np.where(_valid, np.minimum(SPAN_CELLS[:-1, 0], CELL_COUNT - 1) * 4 + movetable.MOVE_DIRECTION, 0), 0)
+
+
+class BatchGrid:
+    def __init__(self, root, size, symmetric=False):
+        count = root.move_count
+        cells = np.append(root.grid.reshape(-1), 0)
+        self.cells = np.tile(cells.astype(np.int16), (size, 1))
+        self.moves = np.tile(packed_to_id(root.moves[:count]), (size, 1))
+        self.priority = np.tile(root.priority[:count], (size, 1))
+        self.count = np.full(size, count)
+        self.history = np.tile(root.history, (size, 1))
+        self.history_count = root.move_history_count
+        self.rows = np.arange(size)
+        # Symmetry-layer transforms of each board, None without the layer.
+        self.groups = None
+        if symmetric:
+            self.groups = np.tile(symmetry.history_group(root.history[:root.move_history_count]), (size, 1))
+
+
+def move_priority(cells, rows, moves):
+    # Priority (0 when illegal) of each (board row, move) pair, as line_priority does for one move.
+    # The segment window is only read for the moves whose five points are filled but the hole.
+    priority = np.zeros(len(moves), dtype=int)
+    flat = cells.reshape(-1)
+    offsets = rows[:, None] * cells.shape[1]
+    filled = ((flat[offsets + SPAN_CELLS[moves]] & 1) != 0) == HOLE_PATTERN[moves]
+    fitting = np.flatnonzero(filled.all(1))
+    offsets, moves = offsets[fitting], moves[fitting]
+    window = (flat[offsets + WINDOW_CELLS[moves]] & MASK_D[moves][:, None]) != 0
+    touch = window[:, 3] | window[:, 8]
+    bad = window[:, [0, 1, 2, 9, 10, 11]].any(1)
+    priority[fitting] = np.where(window[:, 4:8].any(1), 0, np.where(touch, 1010, np.where(bad, 1000, 1005)))
+    return priority
+
+
+def move_codes(cells, moves):
+    rows = np.arange(len(cells))[:, None]
+    bits = cells[rows, END_READ[moves]] | cells[rows, START_READ[moves]]
+    return BASE_CODE[moves] + np.where(bits & MASK_D[moves], MASK_DO[moves], 0) + \
+        np.where(bits & MASK_O[moves], MASK_D[moves], 0)
+
+
+def select_moves(batch, strategy, divisor, stream, temperature=1.0):
+    # Softmax sampling on every board at once, then replacement by the dominating 1010 move of
+    # the same point and direction, as play_move does with grid.dominator.
+    moves = batch.moves
+    if batch.groups is None:
+        weights = strategy.weights[move_codes(batch.cells, moves)]
+    else:
+        codes, _, kept = symmetry.canonical(moves, batch.cells, batch.groups)
+        weights = strategy.weights[codes] * kept
+    if temperature != 1.0:
+        weights = weights ** (1.0 / temperature)
+    weights = weights / divisor[batch.priority] * (moves != PADDING)
+    cumulative = np.cumsum(weights, axis=1)
+    threshold = stream.generator.random(len(moves)) * cumulative[:, -1]
+    choice = np.minimum((cumulative < threshold[:, None]).sum(1), batch.count - 1)
+    rows = np.arange(len(moves))
+    selected = moves[rows, choice]
+    dominating = (moves // 5 == (selected // 5)[:, None]) & (batch.priority == 1010)
+    dominator = np.where(dominating, moves, -1).max(1)
+    return np.where((batch.priority[rows, choice] != 1010) & (dominator >= 0), dominator, selected)
+
+
+def play_moves(batch, played):
+    rows = np.arange(len(played))
+    batch.cells[rows[:, None], SPAN_CELLS[played]] |= CELL_BITS[played]
+    batch.cells[rows, POINT[played]] |= 1
+    if batch.history_count >= MAX_HISTORY_SIZE:
+        raise ValueError("Move history storage table too small")
+    batch.history[:, batch.history_count] = PACKED[played]
+    batch.history_count += 1
+    if batch.groups is not None:
+        batch.groups = symmetry.refine(batch.groups, played)
+
+    candidates = np.sort(np.concatenate([batch.moves, POINT_AFFECTED[POINT[played]], LINE_AFFECTED[LINE_KEY[played]]],
+                                        axis=1), axis=1)
+    candidates[:, 1:][candidates[:, 1:] == candidates[:, :-1]] = PADDING
+    rows, columns = np.nonzero(candidates != PADDING)
+    priority = np.zeros(candidates.shape, dtype=int)
+    priority[rows, columns] = move_priority(batch.cells, rows, candidates[rows, columns])
+    edge = (priority > 0) & ~INNER[candidates]
+    if edge.any():
+        base.report_edge()
+        priority[edge] = 0
+    candidates[priority == 0] = PADDING
+    order = np.argsort(candidates, axis=1, kind='stable')
+    batch.count = (priority > 0).sum(1)
+    width = max(int(batch.count.max()), 1)
+    batch.moves = np.take_along_axis(candidates, order[:, :width], axis=1)
+    batch.priority = np.take_along_axis(priority, order[:, :width], axis=1)
+
+
+def keep_rows(batch, keep):
+    batch.cells = batch.cells[keep]
+    batch.moves = batch.moves[keep]
+    batch.priority = batch.priority[keep]
+    batch.count = batch.count[keep]
+    batch.history = batch.history[keep]
+    batch.rows = batch.rows[keep]
+    if batch.groups is not None:
+        batch.groups = batch.groups[keep]
+
+
+def playouts(root, strategy, size, divisor, stream, temperature=1.0, symmetric=False):
+    # `size` playouts from `root` with the same policy, advanced one move per step on all boards,
+    # drawing from the random stream of the batch.
+    batch = BatchGrid(root, size, symmetric)
+    sequences = [None] * size
+    while len(batch.rows):
+        finished = batch.count == 0
+        for row in np.flatnonzero(finished):
+            sequences[batch.rows[row]] = Sequence(batch.history[row, :batch.history_count])
+        if finished.any():
+            keep_rows(batch, ~finished)
+            if not len(batch.rows):
+                break
+        play_moves(batch, select_moves(batch, strategy, divisor, stream, temperature))
+    return sequences
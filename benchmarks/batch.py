@@ -0,0 +1,57 @@
+import argparse
+import time
+import numpy as np
+import batch
+import nrpa
+from nrpa import Policy, PRIORITY_DIVISOR, playout
+
+
+def complete_games(root, sequences):
+    # A batched playout must be a legal game that ends with no move left. construct_game does not
+    # rescan after the last move on every engine, so the final position is searched again.
+    engine = nrpa.engine
+    for sequence in sequences:
+        grid = engine.construct_game(sequence.moves, root, sequence.score, None)
+        engine.search_moves(grid)
+        complete = grid.move_count == 0
+        engine.pool.release(grid)
+        if not complete:
+            return False
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Playouts per second of the scalar and the lockstep batch engines')
+    parser.add_argument('--playouts', type=int, default=256, help='Playouts per variant')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1, 16, 64, 256], help='Batch sizes to measure')
+    parser.add_argument('--seed', type=int, default=1, help='Random seed')
+    parser.add_argument('--engine', type=str, default='bitboard', choices=list(nrpa.ENGINES), help='Board engine')
+    args = parser.parse_args()
+
+    nrpa.set_engine(args.engine)
+    root = nrpa.engine.Grid()
+    nrpa.engine.initialize_game(root)
+    nrpa.engine.search_moves(root)
+    strategy = Policy()
+
+    stream = nrpa.RandomStream(np.random.SeedSequence(args.seed))
+    start_time = time.time()
+    scores = [playout(root, strategy, None, stream).score for _ in range(args.playouts)]
+    scalar_rate = args.playouts / (time.time() - start_time)
+    print(f"scalar            {scalar_rate:8.1f} playouts/s                 mean score {np.mean(scores):6.2f}")
+
+    for size in args.sizes:
+        stream = nrpa.RandomStream(np.random.SeedSequence(args.seed))
+        sequences = []
+        start_time = time.time()
+        while len(sequences) < args.playouts:
+            sequences += batch.playouts(root, strategy, min(size, args.playouts - len(sequences)), PRIORITY_DIVISOR,
+                                        stream)
+        rate = args.playouts / (time.time() - start_time)
+        print(f"batch {size:<6}      {rate:8.1f} playouts/s  speedup x{rate / scalar_rate:5.2f}  "
+              f"mean score {np.mean([sequence.score for sequence in sequences]):6.2f}  "
+              f"complete={complete_games(root, sequences)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+import argparse
+import time
+import numpy as np
+import base
+import bitboard
+import movetable
+
+
+def array_grid(grid):
+    # Array-engine board holding the same position and move list as a bitboard grid.
+    copy = base.Grid()
+    copy.grid = grid.grid.copy()
+    copy.move_count = grid.move_count
+    copy.moves[:grid.move_count] = grid.moves[:grid.move_count]
+    return copy
+
+
+def timed(function, grid):
+    start_time = time.perf_counter()
+    function(grid, None)
+    return time.perf_counter() - start_time
+
+
+def vectorized_generate(grid, log_file):
+    grid.code[:grid.move_count] = movetable.move_codes(grid.ids[:grid.move_count], grid.cells)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare the generate() loop with the vectorized and cached versions')
+    parser.add_argument('--playouts', type=int, default=20, help='Random playouts to sample positions from')
+    parser.add_argument('--seed', type=int, default=1, help='Random seed')
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    root = bitboard.Grid()
+    bitboard.initialize_game(root)
+    bitboard.search_moves(root)
+    variants = ['array loop', 'bitboard loop', 'vectorized', 'cached']
+    times = dict.fromkeys(variants, 0.0)
+    calls = 0
+    identical = True
+    for _ in range(args.playouts):
+        depth = bitboard.mark(root)
+        while root.move_count > 0:
+            times['cached'] += timed(bitboard.generate, root)
+            cached = root.code[:root.move_count].copy()
+            times['vectorized'] += timed(vectorized_generate, root)
+            identical &= bool((root.code[:root.move_count] == cached).all())
+            times['bitboard loop'] += timed(bitboard.generate_reference, root)
+            identical &= bool((root.code[:root.move_count] == cached).all())
+            reference = array_grid(root)
+            times['array loop'] += timed(base.generate, reference)
+            identical &= bool((reference.code[:root.move_count] == cached).all())
+            calls += 1
+            bitboard.play(root, int(rng.integers(root.move_count)))
+        bitboard.unplay(root, depth)
+
+    for name in variants:
+        print(f"{name:<18} {times[name] / calls * 1e6:8.1f} us/call  speedup x{times['array loop'] / times[name]:6.2f}")
+    print(f"{calls} positions, identical={identical}")
+
+
+if __name__ == "__main__":
+    main()
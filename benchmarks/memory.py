@@ -0,0 +1,94 @@
+import argparse
+import resource
+import subprocess
+import sys
+import tracemalloc
+import numpy as np
+import base
+import nrpa
+from nrpa import Policy, Sequence, playout, select_move
+from benchmarks.playout import copy_playout
+
+VARIANTS = ['copy', 'pooled', 'play/unplay']
+
+
+def pooled_playout(grid, policy, log_file, stream):
+    # copy_playout with its two boards taken from the engine pool and handed back afterwards.
+    engine = nrpa.engine
+    current_grid = engine.pool.acquire(grid)
+    temp_grid = engine.pool.acquire()
+    engine.search_moves(current_grid)
+    while current_grid.move_count > 0:
+        move = select_move(current_grid, policy, log_file, stream)
+        engine.play_move(current_grid, temp_grid, move)
+        engine.search_moves_optimized(current_grid, temp_grid, move)
+        current_grid, temp_grid = temp_grid, current_grid
+    sequence = Sequence(current_grid.history[:current_grid.move_history_count])
+    engine.pool.release(current_grid)
+    engine.pool.release(temp_grid)
+    return sequence
+
+
+def count_grids(grid_type, counter):
+    # Counts the boards built by Grid() and Grid.copy() from here on.
+    def counted(function):
+        def wrapper(*args):
+            counter[0] += 1
+            return function(*args)
+        return wrapper
+    grid_type.__init__ = counted(grid_type.__init__)
+    grid_type.copy = counted(grid_type.copy)
+
+
+def grid_bytes(grid):
+    return sum(getattr(grid, name).nbytes for name in grid.__slots__ if isinstance(getattr(grid, name), np.ndarray))
+
+
+def run_variant(variant, playouts, seed):
+    engine = nrpa.engine
+    root = engine.Grid()
+    engine.initialize_game(root)
+    engine.search_moves(root)
+    strategy = Policy()
+    function = {'copy': copy_playout, 'pooled': pooled_playout, 'play/unplay': playout}[variant]
+
+    counter = [0]
+    count_grids(engine.Grid, counter)
+    stream = nrpa.RandomStream(np.random.SeedSequence(seed))
+    tracemalloc.start()
+    for _ in range(playouts):
+        function(root, strategy, None, stream)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(f"{variant:<12} {counter[0] * 1000 / playouts:8.0f} grids/1000 playouts  "
+          f"{counter[0] * grid_bytes(root) * 1000 / playouts / 2 ** 20:8.1f} MiB allocated/1000 playouts  "
+          f"traced peak {peak / 2 ** 20:6.2f} MiB  peak RSS {rss / 1024:6.1f} MiB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Board allocations and peak memory per playout loop')
+    parser.add_argument('--playouts', type=int, default=100, help='Playouts per variant')
+    parser.add_argument('--seed', type=int, default=1, help='Random seed')
+    parser.add_argument('--engine', type=str, default='bitboard', choices=list(nrpa.ENGINES), help='Board engine')
+    parser.add_argument('--wide', action='store_true', help='Allocate boards with the former int64 arrays')
+    parser.add_argument('--variant', type=str, choices=VARIANTS, help='Measure only this variant, in this process')
+    args = parser.parse_args()
+
+    if args.wide:
+        base.CELL_DTYPE = base.MOVE_DTYPE = base.SLOT_DTYPE = np.int64
+    nrpa.set_engine(args.engine)
+    if args.variant:
+        run_variant(args.variant, args.playouts, args.seed)
+        return
+
+    print(f"{grid_bytes(nrpa.engine.Grid()) / 1024:.1f} KiB of arrays per board")
+    # Peak RSS only grows during a process, so every variant runs in its own interpreter.
+    for variant in VARIANTS:
+        command = [sys.executable, '-m', 'benchmarks.memory', '--variant', variant, '--playouts', str(args.playouts),
+                   '--seed', str(args.seed), '--engine', args.engine] + (['--wide'] if args.wide else [])
+        subprocess.run(command, check=True)
+
+
+if __name__ == "__main__":
+    main()
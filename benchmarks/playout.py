@@ -0,0 +1,49 @@
+import argparse
+import time
+import numpy as np
+import nrpa
+from nrpa import Policy, Sequence, playout, select_move
+
+
+def copy_playout(grid, policy, log_file, stream):
+    # Playout loop used before play/unplay: two boards copied into each other on every move.
+    engine = nrpa.engine
+    current_grid = grid.copy()
+    temp_grid = engine.Grid()
+    engine.search_moves(current_grid)
+    while current_grid.move_count > 0:
+        move = select_move(current_grid, policy, log_file, stream)
+        engine.play_move(current_grid, temp_grid, move)
+        engine.search_moves_optimized(current_grid, temp_grid, move)
+        current_grid, temp_grid = temp_grid, current_grid
+    return Sequence(current_grid.history[:current_grid.move_history_count])
+
+
+def measure(function, root, strategy, count, seed):
+    stream = nrpa.RandomStream(np.random.SeedSequence(seed))
+    start_time = time.time()
+    games = [function(root, strategy, None, stream).moves.tolist() for _ in range(count)]
+    return games, count / (time.time() - start_time)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Playouts per second with copied boards and with play/unplay')
+    parser.add_argument('--playouts', type=int, default=50, help='Playouts per variant')
+    parser.add_argument('--seed', type=int, default=1, help='Seed shared by all variants')
+    parser.add_argument('--engine', type=str, default='bitboard', choices=list(nrpa.ENGINES), help='Board engine')
+    args = parser.parse_args()
+
+    nrpa.set_engine(args.engine)
+    root = nrpa.engine.Grid()
+    nrpa.engine.initialize_game(root)
+    nrpa.engine.search_moves(root)
+    strategy = Policy()
+
+    copied_games, copied_rate = measure(copy_playout, root, strategy, args.playouts, args.seed)
+    games, rate = measure(playout, root, strategy, args.playouts, args.seed)
+    print(f"copy playout      {copied_rate:8.1f} playouts/s")
+    print(f"play/unplay       {rate:8.1f} playouts/s  speedup x{rate / copied_rate:5.2f}  identical={games == copied_games}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+import argparse
+import time
+from collections import defaultdict
+import numpy as np
+import nrpa
+
+
+def profile_run(policy_class, level, iterations, alpha, seed):
+    stats = defaultdict(lambda: {'adapts': 0, 'copies': 0, 'copy_time': 0.0, 'update_time': 0.0, 'bytes': []})
+    levels = []
+    search = nrpa.nrpa
+    original_copy = policy_class.copy
+    original_update = policy_class.update
+
+    def tracked_nrpa(level, *args, **kwargs):
+        levels.append(level)
+        try:
+            return search(level, *args, **kwargs)
+        finally:
+            levels.pop()
+
+    def tracked_copy(self):
+        start_time = time.perf_counter()
+        new_policy = original_copy(self)
+        stats[levels[-1]]['copy_time'] += time.perf_counter() - start_time
+        stats[levels[-1]]['copies'] += 1
+        return new_policy
+
+    def tracked_update(self, codes, deltas):
+        start_time = time.perf_counter()
+        original_update(self, codes, deltas)
+        stats[levels[-1]]['update_time'] += time.perf_counter() - start_time
+        stats[levels[-1]]['adapts'] += 1
+        stats[levels[-1]]['bytes'].append(self.nbytes)
+
+    nrpa.nrpa = tracked_nrpa
+    policy_class.copy = tracked_copy
+    policy_class.update = tracked_update
+    try:
+        root = nrpa.engine.Grid()
+        nrpa.engine.initialize_game(root)
+        nrpa.engine.search_moves(root)
+        result = nrpa.nrpa(level, root, policy_class(), None, iterations, alpha,
+                           nrpa.RandomStream(np.random.SeedSequence(seed)))
+    finally:
+        nrpa.nrpa = search
+        policy_class.copy = original_copy
+        policy_class.update = original_update
+    return result.score, stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Per-level memory and copy cost of dense and sparse policies')
+    parser.add_argument('--level', type=int, default=2, help='Nesting level of the profiled run')
+    parser.add_argument('--iterations', type=int, default=10, help='Iterations per level')
+    parser.add_argument('--alpha', type=float, default=1.0, help='Learning rate')
+    parser.add_argument('--seed', type=int, default=1, help='Seed shared by both runs')
+    args = parser.parse_args()
+
+    for name, policy_class in nrpa.POLICIES.items():
+        moves, stats = profile_run(policy_class, args.level, args.iterations, args.alpha, args.seed)
+        print(f"{name} policy: best sequence {moves} moves")
+        for level in sorted(stats):
+            entry = stats[level]
+            print(f"  level {level}: adapts={entry['adapts']:5d} copies={entry['copies']:5d} "
+                  f"copy={entry['copy_time'] / max(entry['copies'], 1) * 1e6:7.2f} us "
+                  f"update={entry['update_time'] / max(entry['adapts'], 1) * 1e6:7.2f} us "
+                  f"bytes mean={np.mean(entry['bytes']) if entry['bytes'] else 0:9.0f} "
+                  f"max={max(entry['bytes'], default=0):7d}")
+
+
+if __name__ == "__main__":
+    main()
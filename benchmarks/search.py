@@ -0,0 +1,80 @@
+import argparse
+import time
+import numpy as np
+import nrpa
+from nrpa import Policy
+
+
+def run_search(name, width, temperature, level, root, iterations, alpha, seed, target, budget):
+    # Score of one search from the initial cross stopped after `budget` seconds (the anytime mode of
+    # main.py --time-budget), with its playouts, time, and the playouts and seconds it took a playout
+    # to first reach `target` moves (None if none did).
+    nrpa.set_search(name, width, temperature)
+    playout = nrpa.playout
+    stats = {'playouts': 0, 'to_target': None}
+
+    def counted(grid, strategy, log_file, stream):
+        sequence = playout(grid, strategy, log_file, stream)
+        stats['playouts'] += 1
+        if stats['to_target'] is None and sequence.score >= target:
+            stats['to_target'] = (stats['playouts'], time.time() - start_time)
+        return sequence
+
+    nrpa.playout = counted
+    stream = nrpa.RandomStream(np.random.SeedSequence(seed))
+    start_time = time.time()
+    nrpa.deadline = start_time + budget
+    if name == 'beam':
+        best = nrpa.beam_nrpa(level, root, Policy(), None, iterations, alpha, stream)[0][0]
+    else:
+        best = nrpa.nrpa(level, root, Policy(), None, iterations, alpha, stream)
+    elapsed = time.time() - start_time
+    nrpa.deadline = None
+    nrpa.playout = playout
+    return best.score, stats['playouts'], elapsed, stats['to_target']
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Scores and playouts of NRPA, Beam NRPA and GNRPA searches at equal time')
+    parser.add_argument('--level', type=int, default=2, help='Nesting level')
+    parser.add_argument('--time-budget', type=float, default=10.0, help='Seconds of wall time per search')
+    parser.add_argument('--iterations', type=int, default=100, help='Iterations per level, a cap within the budget')
+    parser.add_argument('--alpha', type=float, default=1.0, help='Learning rate')
+    parser.add_argument('--seeds', type=int, default=3, help='Searches per variant, seeded 1..seeds')
+    parser.add_argument('--target', type=int, default=80, help='Score whose first playout is reported')
+    parser.add_argument('--beam-widths', type=int, nargs='+', default=[2, 4], help='Beam NRPA widths')
+    parser.add_argument('--temperatures', type=float, nargs='+', default=[1.0, 0.5], help='GNRPA temperatures')
+    parser.add_argument('--symmetry', action='store_true', help='Also run every variant with the symmetry layer')
+    parser.add_argument('--engine', type=str, default='bitboard', choices=list(nrpa.ENGINES), help='Board engine')
+    args = parser.parse_args()
+
+    nrpa.set_engine(args.engine)
+    root = nrpa.engine.Grid()
+    nrpa.engine.initialize_game(root)
+    nrpa.engine.search_moves(root)
+
+    variants = [('nrpa', 'nrpa', 1, 1.0)]
+    variants += [(f'beam B={width}', 'beam', width, 1.0) for width in args.beam_widths]
+    variants += [(f'gnrpa T={temperature:g}', 'gnrpa', 1, temperature) for temperature in args.temperatures]
+    if args.symmetry:
+        variants = [(label + suffix, name, width, temperature, layer) for label, name, width, temperature in variants
+                    for suffix, layer in [('', False), (' +sym', True)]]
+    else:
+        variants = [variant + (False,) for variant in variants]
+    for label, name, width, temperature, layer in variants:
+        nrpa.set_symmetry(layer)
+        runs = [run_search(name, width, temperature, args.level, root, args.iterations, args.alpha, seed, args.target,
+                           args.time_budget) for seed in range(1, args.seeds + 1)]
+        scores, playouts, times, to_target = zip(*runs)
+        reached = [point for point in to_target if point is not None]
+        print(f"{label:<19} score mean {np.mean(scores):6.1f} max {max(scores):4d}  {np.mean(playouts):8.0f} playouts  "
+              f"{np.mean(times):7.2f}s  {np.mean(playouts) / np.mean(times):7.1f} playouts/s  "
+              f"{args.target}+ in {len(reached)}/{len(runs)} runs"
+              + (f" after {np.median([count for count, _ in reached]):.0f} playouts, "
+                 f"{np.median([seconds for _, seconds in reached]):.2f}s (median)" if reached else ""))
+    nrpa.set_search('nrpa')
+    nrpa.set_symmetry(False)
+
+
+if __name__ == "__main__":
+    main()
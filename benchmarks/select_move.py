@@ -0,0 +1,57 @@
+import argparse
+import time
+import timeit
+import numpy as np
+import nrpa
+from nrpa import Policy, playout
+
+
+def run_playouts(selector, root, strategy, count, seed, block):
+    nrpa.select_move = selector
+    stream = nrpa.RandomStream(np.random.SeedSequence(seed), block)
+    games = []
+    start_time = time.time()
+    for _ in range(count):
+        result = playout(root, strategy, None, stream)
+        games.append(result.moves.tolist())
+    return games, (time.time() - start_time) / count
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare vectorized and reference select_move')
+    parser.add_argument('--playouts', type=int, default=50, help='Playouts per variant')
+    parser.add_argument('--seed', type=int, default=1, help='Seed shared by all variants')
+    parser.add_argument('--block', type=int, default=4096, help='Uniform block size for the blocked variant')
+    parser.add_argument('--engine', type=str, default='bitboard', choices=list(nrpa.ENGINES), help='Board engine')
+    args = parser.parse_args()
+
+    nrpa.set_engine(args.engine)
+    root = nrpa.engine.Grid()
+    nrpa.engine.initialize_game(root)
+    nrpa.engine.search_moves(root)
+    strategy = Policy()
+    strategy.policy = np.random.default_rng(args.seed).normal(0.0, 1.0, strategy.policy.shape)
+    strategy.refresh()
+
+    reference = nrpa.select_move_reference
+    vectorized = nrpa.select_move
+    variants = [('reference', reference, 0), ('vectorized', vectorized, 0), ('vectorized+block', vectorized, args.block)]
+    results = {name: run_playouts(selector, root, strategy, args.playouts, args.seed, block)
+               for name, selector, block in variants}
+
+    generate_time = timeit.timeit(lambda: nrpa.engine.generate(root, None), number=1000) / 1000
+    call_times = {}
+    for name, selector, block in variants:
+        stream = nrpa.RandomStream(np.random.SeedSequence(args.seed), block)
+        call_times[name] = timeit.timeit(lambda: selector(root, strategy, None, stream), number=1000) / 1000 - \
+            generate_time
+    nrpa.select_move = vectorized
+
+    base_games, base_time = results['reference']
+    for name, (games, per_playout) in results.items():
+        print(f"{name:<18} {per_playout * 1000:8.2f} ms/playout  speedup x{base_time / per_playout:5.2f}  "
+              f"{call_times[name] * 1e6:7.1f} us/selection  identical={games == base_games}")
+
+
+if __name__ == "__main__":
+    main()
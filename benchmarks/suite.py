@@ -0,0 +1,247 @@
+import argparse
+import glob
+import json
+import platform
+import subprocess
+import time
+import numpy as np
+import base
+import movetable
+import nrpa
+from nrpa import Policy, Sequence
+from benchmarks.playout import copy_playout
+
+KERNELS = ['search_moves', 'play_move', 'search_moves_optimized', 'generate', 'select_move', 'adapt', 'adapt cached',
+           'playout', 'nrpa level 1']
+
+
+def read_games(path):
+    # Longest game recorded in a result file: the "Move history" blocks of display_game.
+    games = []
+    moves = None
+    for line in open(path):
+        if line.startswith("Move history"):
+            moves = []
+            games.append(moves)
+        elif line.startswith("move ") and moves is not None:
+            moves.append(int(line.split()[2]))
+        else:
+            moves = None
+    return max(games, key=len, default=[])
+
+
+def commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True).stdout.strip()
+    except OSError:
+        return ''
+
+
+class Position:
+    def __init__(self, engine, game, depth):
+        root = engine.Grid()
+        engine.initialize_game(root)
+        engine.search_moves(root)
+        self.grid = engine.construct_game(game, root, depth, None)
+        engine.search_moves(self.grid)
+        self.game = Sequence(game)
+        self.depth = depth
+        self.index = int(np.flatnonzero(self.grid.moves[:self.grid.move_count] == game[depth])[0])
+
+
+def move_list(grid):
+    return sorted(zip(grid.moves[:grid.move_count].tolist(), grid.priority[:grid.move_count].tolist(),
+                      grid.code[:grid.move_count].tolist()))
+
+
+def seeded(seed):
+    return nrpa.RandomStream(np.random.SeedSequence(seed))
+
+
+def measure(engine, positions, strategy, iterations, seed):
+    # Seconds spent in each kernel over all positions. Every call works on a pooled copy of the
+    # position, so kernels that update the board or its cached codes see the same starting state.
+    pool = engine.pool
+    times = dict.fromkeys(KERNELS, 0.0)
+    calls = dict.fromkeys(KERNELS, 0)
+
+    def timed(kernel, function, *args):
+        start_time = time.perf_counter()
+        result = function(*args)
+        times[kernel] += time.perf_counter() - start_time
+        calls[kernel] += 1
+        return result
+
+    for i, position in enumerate(positions):
+        grid = pool.acquire(position.grid)
+        timed('search_moves', engine.search_moves, grid)
+        target = pool.acquire()
+        timed('play_move', engine.play_move, grid, target, position.index)
+        timed('search_moves_optimized', engine.search_moves_optimized, grid, target, position.index)
+        pool.release(target)
+        timed('generate', engine.generate, grid, None)
+        grid.copy_from(position.grid)
+        timed('select_move', nrpa.select_move, grid, strategy, None, seeded(seed + i))
+
+        nrpa.set_replay_cache_size(0)
+        timed('adapt', nrpa.adapt, strategy, grid, position.game, None, 1.0)
+        nrpa.set_replay_cache_size(100000)
+        nrpa.adapt(strategy, grid, position.game, None, 1.0)
+        timed('adapt cached', nrpa.adapt, strategy, grid, position.game, None, 1.0)
+
+        timed('playout', nrpa.playout, grid, strategy, None, seeded(seed + i))
+        timed('nrpa level 1', nrpa.nrpa, 1, grid, Policy(), None, iterations, 1.0, seeded(seed + i))
+        pool.release(grid)
+    return times, calls
+
+
+def check(engine, positions, references, strategy, seed):
+    # Fast paths against the reference functions, on every position: move lists of search_moves
+    # and search_moves_optimized against the array engine, generated codes against the per-move
+    # loops and the move tables, seeded choices against select_move_reference, play/unplay
+    # playouts against the copy loop and cached adapt against adapt without cache.
+    checks = {}
+
+    def record(name, passed):
+        checks[name] = checks.get(name, True) and bool(passed)
+
+    pool = engine.pool
+    for i, (position, reference) in enumerate(zip(positions, references)):
+        grid = pool.acquire(position.grid)
+        engine.generate(grid, None)
+        expected = base.pool.acquire(reference.grid)
+        base.search_moves(expected)
+        base.generate(expected, None)
+        record('search_moves == array search_moves', move_list(grid) == move_list(expected))
+        ids = movetable.packed_to_id(grid.moves[:grid.move_count])
+        record('generate == move table codes',
+               (grid.code[:grid.move_count] == movetable.move_codes(ids, grid.grid.reshape(-1))).all())
+        if engine is not base:
+            codes = grid.code[:grid.move_count].copy()
+            engine.generate_reference(grid, None)
+            record('generate == generate_reference', (grid.code[:grid.move_count] == codes).all())
+
+        target = pool.acquire()
+        engine.play_move(grid, target, position.index)
+        engine.search_moves_optimized(grid, target, position.index)
+        engine.generate(target, None)
+        searched = pool.acquire(target)
+        engine.search_moves(searched)
+        engine.generate(searched, None)
+        record('search_moves_optimized == search_moves', move_list(target) == move_list(searched))
+        base_target = base.pool.acquire()
+        base.play_move(expected, base_target, reference.index)
+        record('play_move == array play_move', (target.grid == base_target.grid).all())
+        pool.release(target)
+        pool.release(searched)
+        base.pool.release(expected)
+        base.pool.release(base_target)
+
+        grid.copy_from(position.grid)
+        selected = nrpa.select_move(grid, strategy, None, seeded(seed + i))
+        record('select_move == select_move_reference',
+               selected == nrpa.select_move_reference(grid, strategy, None, seeded(seed + i)))
+
+        played = nrpa.playout(grid, strategy, None, seeded(seed + i)).moves.tolist()
+        record('playout == copy playout',
+               played == copy_playout(grid, strategy, None, seeded(seed + i)).moves.tolist())
+
+        nrpa.set_replay_cache_size(0)
+        uncached = nrpa.adapt(strategy, grid, position.game, None, 1.0)
+        nrpa.set_replay_cache_size(100000)
+        nrpa.adapt(strategy, grid, position.game, None, 1.0)
+        cached = nrpa.adapt(strategy, grid, position.game, None, 1.0)
+        record('adapt cached == adapt', all((a == b).all() for a, b in zip(uncached.entries(), cached.entries())))
+        pool.release(grid)
+    return checks
+
+
+def compare(results, baseline, tolerance):
+    # Kernels whose time per call grew by more than tolerance since the baseline results.
+    regressions = []
+    for engine_name, kernels in results['engines'].items():
+        for kernel, entry in kernels.items():
+            previous = baseline.get('engines', {}).get(engine_name, {}).get(kernel)
+            if previous:
+                entry['baseline_us'] = previous['us_per_call']
+                if entry['us_per_call'] > previous['us_per_call'] * (1 + tolerance):
+                    regressions.append(f"{engine_name} {kernel}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Kernel timings and parity checks on positions from recorded games')
+    parser.add_argument('--games', type=str, nargs='+', default=sorted(glob.glob('logs/*.txt')),
+                        help='Result files whose recorded games provide the positions')
+    parser.add_argument('--positions', type=int, default=4, help='Positions sampled from each game')
+    parser.add_argument('--iterations', type=int, default=10, help='Iterations of the level-1 NRPA kernel')
+    parser.add_argument('--repeat', type=int, default=3, help='Timing repetitions; the fastest one is kept')
+    parser.add_argument('--seed', type=int, default=1, help='Random seed')
+    parser.add_argument('--engines', type=str, nargs='+', default=list(nrpa.ENGINES), choices=list(nrpa.ENGINES),
+                        help='Board engines to measure')
+    parser.add_argument('--output', type=str, default=None, help='JSON file to save the results to')
+    parser.add_argument('--baseline', type=str, default=None, help='JSON results of an earlier commit to compare with')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='Relative slowdown from the baseline reported as a regression')
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    samples = []
+    games = 0
+    for path in args.games:
+        game = read_games(path)
+        if game:
+            games += 1
+            depths = np.sort(rng.choice(len(game), size=min(args.positions, len(game)), replace=False))
+            samples += [(np.array(game), int(depth)) for depth in depths]
+    strategy = Policy()
+    strategy.policy = rng.normal(0.0, 0.5, strategy.policy.shape)
+    strategy.refresh()
+
+    references = [Position(base, game, depth) for game, depth in samples]
+    results = {'commit': commit(), 'time': time.strftime('%Y-%m-%dT%H:%M:%S'), 'python': platform.python_version(),
+               'numpy': np.__version__, 'games': games, 'positions': len(samples), 'seed': args.seed, 'engines': {}, 'checks': {}}
+    for engine_name in args.engines:
+        nrpa.set_engine(engine_name)
+        engine = nrpa.engine
+        positions = references if engine is base else [Position(engine, game, depth) for game, depth in samples]
+        best = dict.fromkeys(KERNELS, float('inf'))
+        for _ in range(args.repeat):
+            times, calls = measure(engine, positions, strategy, args.iterations, args.seed)
+            best = {kernel: min(best[kernel], times[kernel]) for kernel in KERNELS}
+        results['engines'][engine_name] = {kernel: {'calls': calls[kernel], 'us_per_call': best[kernel] / calls[kernel] * 1e6}
+                                           for kernel in KERNELS}
+        results['engines'][engine_name]['nrpa level 1']['playouts_per_s'] = \
+            calls['nrpa level 1'] * args.iterations / best['nrpa level 1']
+        results['checks'][engine_name] = check(engine, positions, references, strategy, args.seed)
+
+    regressions = []
+    if args.baseline:
+        with open(args.baseline) as file:
+            regressions = compare(results, json.load(file), args.tolerance)
+        results['regressions'] = regressions
+
+    for engine_name, kernels in results['engines'].items():
+        print(f"{engine_name} engine, {len(samples)} positions from {games} games")
+        for kernel, entry in kernels.items():
+            line = f"  {kernel:<24} {entry['us_per_call']:10.1f} us/call"
+            if 'baseline_us' in entry:
+                line += f"  baseline {entry['baseline_us']:10.1f} us  x{entry['us_per_call'] / entry['baseline_us']:5.2f}"
+            if 'playouts_per_s' in entry:
+                line += f"  {entry['playouts_per_s']:.1f} playouts/s"
+            print(line)
+        for name, passed in results['checks'][engine_name].items():
+            print(f"  {name:<44} {'ok' if passed else 'FAILED'}")
+    for regression in regressions:
+        print(f"regression: {regression}")
+
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(results, file, indent=2)
+    passed = all(all(checks.values()) for checks in results['checks'].values())
+    if not passed or regressions:
+        exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,515 @@
+import numpy as np
+import logging
+
+import base
+import movetable
+from base import MAX_GRID_SIZE, MAX_HISTORY_SIZE, MAX_LEGAL_MOVES
+from movetable import packed_to_id
+
+# Each of the four directions keeps its own set of lines: a line is a Python int holding one bit
+# per point along it, and the lines of all directions are stored back to back in one flat list.
+# `occupied[line]` marks dots, `lines[line]` marks used unit segments (bit p set = the segment from
+# point p to point p + 1 along the line direction belongs to an alignment).
+# Positions are shifted by PAD so that windows reaching past the border never use negative shifts.
+PAD = 8
+DIR_X = [0, 1, 1, 1]
+DIR_Y = [1, 1, 0, -1]
+DIR_D = [2, 4, 8, 16]
+DIR_O = [32, 64, 128, 256]
+DIR_DO = [34, 68, 136, 272]
+LINE_COUNT = [MAX_GRID_SIZE, 2 * MAX_GRID_SIZE - 1, MAX_GRID_SIZE, 2 * MAX_GRID_SIZE - 1]
+LINE_BASE = [sum(LINE_COUNT[:direction]) for direction in range(4)]
+TOTAL_LINES = sum(LINE_COUNT)
+
+# Segment window read from 4 points before the start of a candidate line up to 7 points after it.
+WINDOW_MASK = 0xFFF
+USED_MASK = 0x0F0
+TOUCH_MASK = 0x108
+BAD_MASK = 0xE07
+HOLE_MASK = [31 ^ (1 << (4 - k)) for k in range(5)]
+
+
+def cell_line(direction, x, y):
+    if direction == 0:
+        return x, y + PAD
+    if direction == 1:
+        return x - y + MAX_GRID_SIZE - 1, x + PAD
+    if direction == 2:
+        return y, x + PAD
+    return x + y, x + PAD
+
+
+def line_cell(direction, line, pos):
+    if direction == 0:
+        return line, pos - PAD
+    if direction == 1:
+        return pos - PAD, pos - PAD - line + MAX_GRID_SIZE - 1
+    if direction == 2:
+        return pos - PAD, line
+    return pos - PAD, line - pos + PAD
+
+
+LINE_INDEX = [[LINE_BASE[d] + cell_line(d, x, y)[0] for x in range(MAX_GRID_SIZE) for y in range(MAX_GRID_SIZE)] for d in range(4)]
+LINE_POS = [[cell_line(d, x, y)[1] for x in range(MAX_GRID_SIZE) for y in range(MAX_GRID_SIZE)] for d in range(4)]
+LINE_DIRECTION = [d for d in range(4) for line in range(LINE_COUNT[d])]
+LINE_LENGTH = MAX_GRID_SIZE + 3 * PAD
+
+
+def line_cells(direction, line):
+    cells = []
+    for pos in range(LINE_LENGTH):
+        x, y = line_cell(direction, line, pos)
+        on_board = 0 <= x < MAX_GRID_SIZE and 0 <= y < MAX_GRID_SIZE
+        cells.append(x * MAX_GRID_SIZE + y if on_board else -1)
+    return cells
+
+
+# Flat cell index of every position of every line (-1 off the board).
+LINE_CELLS = [line_cells(d, line) for d in range(4) for line in range(LINE_COUNT[d])]
+
+# Per move id: the line it is drawn on and the position of its first point on that line. Moves
+# running off the board keep -1 and are never generated.
+MOVE_K = movetable.MOVE_K.tolist()
+MOVE_CELL = movetable.MOVE_CELL.tolist()
+MOVE_PACKED = movetable.MOVE_PACKED.tolist()
+MOVE_ZOBRIST = movetable.MOVE_ZOBRIST.tolist()
+MOVE_LINE = [LINE_INDEX[d][cell] if valid else -1 for d, cell, valid in
+             zip(movetable.MOVE_DIRECTION.tolist(), MOVE_CELL, movetable.MOVE_VALID.tolist())]
+MOVE_START = [LINE_POS[d][cell] + k - 4 if valid else -1 for d, cell, k, valid in
+              zip(movetable.MOVE_DIRECTION.tolist(), MOVE_CELL, MOVE_K, movetable.MOVE_VALID.tolist())]
+MOVE_INNER = ((movetable.MOVE_X > 1) & (movetable.MOVE_Y > 1) & (movetable.MOVE_X < MAX_GRID_SIZE - 2) &
+              (movetable.MOVE_Y < MAX_GRID_SIZE - 2)).tolist()
+
+
+def endpoint_lines(cells_x, cells_y, directions):
+    # Lines and positions of the transposed endpoint cells read by generate().
+    cells = (cells_y * MAX_GRID_SIZE + cells_x).tolist()
+    valid = movetable.MOVE_VALID.tolist()
+    return [LINE_INDEX[d][cell] if ok else -1 for d, cell, ok in zip(directions, cells, valid)], \
+        [LINE_POS[d][cell] if ok else -1 for d, cell, ok in zip(directions, cells, valid)]
+
+
+MOVE_END_LINE, MOVE_END_POS = endpoint_lines(movetable.MOVE_END_X, movetable.MOVE_END_Y, movetable.MOVE_DIRECTION.tolist())
+MOVE_START_LINE, MOVE_START_POS = endpoint_lines(movetable.MOVE_START_X, movetable.MOVE_START_Y,
+                                                 movetable.MOVE_DIRECTION.tolist())
+MOVE_BASE_CODE = movetable.MOVE_BASE_CODE.tolist()
+MOVE_MASK_D = movetable.MOVE_MASK_D.tolist()
+MOVE_MASK_DO = movetable.MOVE_MASK_DO.tolist()
+MOVE_CELLS = movetable.MOVE_CELLS.tolist()
+
+
+def code_readers():
+    # readers[cell * 4 + direction] lists the moves of that direction whose generate() code reads
+    # the cell, so a move only invalidates the cached codes of the moves reading its five cells.
+    readers = [[] for _ in range(MAX_GRID_SIZE * MAX_GRID_SIZE * 4)]
+    valid = np.flatnonzero(movetable.MOVE_VALID)
+    for cells in (movetable.MOVE_END_READ, movetable.MOVE_START_READ):
+        for move, key in zip(valid.tolist(), (cells[valid] * 4 + movetable.MOVE_DIRECTION[valid]).tolist()):
+            readers[key].append(move)
+    return readers
+
+
+CODE_READERS = code_readers()
+VECTOR_BATCH = 64
+
+
+class Grid:
+    __slots__ = ('move_history_count', 'occupied', 'lines', 'cells', 'history', 'history_ids', 'move_count', 'moves',
+                 'ids', 'priority', 'dominator', 'code', 'index', 'dominant', 'stale', 'hash', 'bounds', 'marks')
+
+    def __init__(self):
+        self.cells = np.zeros(MAX_GRID_SIZE * MAX_GRID_SIZE, dtype=base.CELL_DTYPE)
+        self.history = np.zeros(MAX_HISTORY_SIZE, dtype=base.MOVE_DTYPE)
+        self.history_ids = np.zeros(MAX_HISTORY_SIZE, dtype=base.MOVE_DTYPE)
+        self.moves = np.zeros(MAX_LEGAL_MOVES, dtype=base.MOVE_DTYPE)
+        self.ids = np.zeros(MAX_LEGAL_MOVES, dtype=base.MOVE_DTYPE)
+        self.priority = np.zeros(MAX_LEGAL_MOVES, dtype=base.SLOT_DTYPE)
+        self.dominator = np.zeros(MAX_LEGAL_MOVES, dtype=base.SLOT_DTYPE)
+        self.code = np.zeros(MAX_LEGAL_MOVES, dtype=base.SLOT_DTYPE)
+        self.reset()
+
+    def reset(self):
+        self.move_history_count = 0
+        self.occupied = [0] * TOTAL_LINES
+        self.lines = [0] * TOTAL_LINES
+        self.cells.fill(0)
+        self.move_count = 0
+        self.dominator.fill(999)
+        self.index = {}
+        self.dominant = {}
+        self.stale = set()
+        self.hash = 0
+        self.bounds = base.EMPTY_BOUNDS
+        self.marks = {}
+
+    def copy(self):
+        new_grid = Grid.__new__(Grid)
+        new_grid.move_history_count = self.move_history_count
+        new_grid.occupied = self.occupied.copy()
+        new_grid.lines = self.lines.copy()
+        new_grid.cells = self.cells.copy()
+        new_grid.history = self.history.copy()
+        new_grid.history_ids = self.history_ids.copy()
+        new_grid.move_count = self.move_count
+        new_grid.moves = self.moves.copy()
+        new_grid.ids = self.ids.copy()
+        new_grid.priority = self.priority.copy()
+        new_grid.dominator = self.dominator.copy()
+        new_grid.code = self.code.copy()
+        new_grid.index = self.index.copy()
+        new_grid.dominant = self.dominant.copy()
+        new_grid.stale = self.stale.copy()
+        new_grid.hash = self.hash
+        new_grid.bounds = self.bounds
+        new_grid.marks = {}
+        return new_grid
+
+    def copy_from(self, source):
+        self.move_history_count = source.move_history_count
+        self.occupied[:] = source.occupied
+        self.lines[:] = source.lines
+        np.copyto(self.cells, source.cells)
+        np.copyto(self.history, source.history)
+        np.copyto(self.history_ids, source.history_ids)
+        self.move_count = source.move_count
+        np.copyto(self.moves, source.moves)
+        np.copyto(self.ids, source.ids)
+        np.copyto(self.priority, source.priority)
+        np.copyto(self.dominator, source.dominator)
+        np.copyto(self.code, source.code)
+        self.index = source.index.copy()
+        self.dominant = source.dominant.copy()
+        self.stale = source.stale.copy()
+        self.hash = source.hash
+        self.bounds = source.bounds
+        self.marks = {}
+
+    @property
+    def grid(self):
+        return self.cells.reshape(MAX_GRID_SIZE, MAX_GRID_SIZE)
+
+
+def load_cells(grid, cells):
+    grid.occupied = [0] * TOTAL_LINES
+    grid.lines = [0] * TOTAL_LINES
+    np.copyto(grid.cells, cells.reshape(-1))
+    grid.bounds = base.cell_bounds(cells)
+    for x, y in zip(*np.nonzero(cells)):
+        cell = x * MAX_GRID_SIZE + y
+        for direction in range(4):
+            bit = 1 << LINE_POS[direction][cell]
+            if cells[x, y] & 1:
+                grid.occupied[LINE_INDEX[direction][cell]] |= bit
+            if cells[x, y] & DIR_D[direction]:
+                grid.lines[LINE_INDEX[direction][cell]] |= bit
+
+
+def initialize_game(grid):
+    cells = base.Grid()
+    base.initialize_game(cells)
+    grid.move_history_count = 0
+    grid.hash = 0
+    load_cells(grid, cells.grid)
+    return 0
+
+
+def line_priority(grid, line, start, move_k):
+    if (grid.occupied[line] >> start) & 31 != HOLE_MASK[move_k]:
+        return 0
+    window = (grid.lines[line] >> (start - 4)) & WINDOW_MASK
+    if window & USED_MASK:
+        return 0
+    if window & TOUCH_MASK:
+        return 1010
+    if window & BAD_MASK:
+        return 1000
+    return 1005
+
+
+def insert_move(grid, move, priority):
+    if grid.move_count >= MAX_LEGAL_MOVES:
+        raise ValueError("Move table too small")
+    grid.moves[grid.move_count] = MOVE_PACKED[move]
+    grid.ids[grid.move_count] = move
+    grid.priority[grid.move_count] = priority
+    grid.dominator[grid.move_count] = 999
+    grid.index[move] = grid.move_count
+    grid.stale.add(move)
+    grid.move_count += 1
+
+
+def remove_move(grid, move, touched):
+    slot = grid.index.pop(move)
+    last = grid.move_count - 1
+    if slot != last:
+        moved = int(grid.ids[last])
+        grid.moves[slot] = grid.moves[last]
+        grid.ids[slot] = moved
+        grid.priority[slot] = grid.priority[last]
+        grid.code[slot] = grid.code[last]
+        grid.index[moved] = slot
+        touched.add(moved // 5)
+    grid.move_count = last
+    touched.add(move // 5)
+
+
+def refresh_dominators(grid, keys):
+    # Moves are dense ids and a key is id // 5, i.e. the (x, y, direction) part of a move. Within
+    # a key the 1010 move with the highest k dominates the others, as update_dominator does on a
+    # sorted list.
+    for key in keys:
+        slots = [grid.index.get(key * 5 + move_k) for move_k in range(5)]
+        dominant = None
+        for move_k in range(5):
+            if slots[move_k] is not None and grid.priority[slots[move_k]] == 1010:
+                dominant = move_k
+        if dominant is None:
+            grid.dominant.pop(key, None)
+        else:
+            grid.dominant[key] = key * 5 + dominant
+        for slot in slots:
+            if slot is not None:
+                if dominant is None or grid.priority[slot] == 1010:
+                    grid.dominator[slot] = 999
+                else:
+                    grid.dominator[slot] = slots[dominant]
+
+
+def line_moves(grid, line, start_min, start_max):
+    occupied = grid.occupied[line]
+    segments = grid.lines[line]
+    direction = LINE_DIRECTION[line]
+    cells = LINE_CELLS[line]
+    free = ~(segments | (segments >> 1) | (segments >> 2) | (segments >> 3))
+    shifted = [occupied >> hole for hole in range(5)]
+    found = []
+    for hole in range(5):
+        starts = free & ~shifted[hole]
+        for other in range(5):
+            if other != hole:
+                starts &= shifted[other]
+        starts &= (1 << (start_max + 1)) - (1 << start_min)
+        move_k = 4 - hole
+        while starts:
+            low = starts & -starts
+            start = low.bit_length() - 1
+            starts ^= low
+            cell = cells[start + hole]
+            move = (cell * 4 + direction) * 5 + move_k
+            if cell < 0 or not MOVE_INNER[move]:
+                base.report_edge()
+                continue
+            found.append((move, line_priority(grid, line, start, move_k)))
+    return found
+
+
+def search_moves(grid):
+    grid.move_count = 0
+    grid.index = {}
+    grid.dominant = {}
+    grid.stale = set()
+    found = []
+    for line in range(TOTAL_LINES):
+        if grid.occupied[line]:
+            found.extend(line_moves(grid, line, PAD - 3, PAD + MAX_GRID_SIZE))
+    for move, priority in sorted(found):
+        insert_move(grid, move, priority)
+    refresh_dominators(grid, {move // 5 for move, priority in found})
+
+
+def update_moves(grid, played):
+    # Only three groups of moves can change when `played` is added: moves whose hole is the new
+    # point, moves on the played line whose segment window overlaps the new segments, and new
+    # moves using the new point as a support.
+    touched = set()
+    cell = MOVE_CELL[played]
+    direction = LINE_DIRECTION[MOVE_LINE[played]]
+    for point in MOVE_CELLS[played]:
+        grid.stale.update(CODE_READERS[point * 4 + direction])
+
+    for move in range(cell * 20, cell * 20 + 20):
+        if move in grid.index:
+            remove_move(grid, move, touched)
+
+    line = MOVE_LINE[played]
+    start = MOVE_START[played]
+    direction = LINE_DIRECTION[line]
+    cells = LINE_CELLS[line]
+    empty = ~grid.occupied[line]
+    for pos in range(max(start - 7, 0), start + 12):
+        if not (empty >> pos) & 1 or cells[pos] < 0:
+            continue
+        key = (cells[pos] * 4 + direction) * 5
+        for other_k in range(5):
+            slot = grid.index.get(key + other_k)
+            if slot is None:
+                continue
+            priority = line_priority(grid, line, pos + other_k - 4, other_k)
+            if not priority:
+                remove_move(grid, key + other_k, touched)
+            elif priority != grid.priority[slot]:
+                grid.priority[slot] = priority
+                touched.add(key // 5)
+
+    for direction in range(4):
+        pos = LINE_POS[direction][cell]
+        found = line_moves(grid, LINE_INDEX[direction][cell], pos - 4, pos)
+        for move, priority in sorted(found):
+            if move not in grid.index:
+                insert_move(grid, move, priority)
+                touched.add(move // 5)
+    refresh_dominators(grid, touched)
+
+
+def copy_moves(source_grid, target_grid):
+    count = source_grid.move_count
+    target_grid.move_count = count
+    target_grid.moves[:count] = source_grid.moves[:count]
+    target_grid.ids[:count] = source_grid.ids[:count]
+    target_grid.priority[:count] = source_grid.priority[:count]
+    target_grid.dominator[:count] = source_grid.dominator[:count]
+    target_grid.code[:count] = source_grid.code[:count]
+    target_grid.index = source_grid.index.copy()
+    target_grid.dominant = source_grid.dominant.copy()
+    target_grid.stale = source_grid.stale.copy()
+
+
+def search_moves_optimized(grid_a, grid_b, played_move):
+    if grid_a is not grid_b:
+        copy_moves(grid_a, grid_b)
+    update_moves(grid_b, int(grid_b.history_ids[grid_b.move_history_count - 1]))
+
+
+def play(grid, move_index):
+    play_move(grid, grid, move_index)
+    update_moves(grid, int(grid.history_ids[grid.move_history_count - 1]))
+
+
+def save_moves(grid):
+    return base.save_moves(grid) + (grid.ids[:grid.move_count].copy(), grid.index.copy(), grid.dominant.copy(),
+                                    grid.stale.copy())
+
+
+def restore_moves(grid, saved):
+    base.restore_moves(grid, saved[:5])
+    grid.ids[:grid.move_count] = saved[5]
+    grid.index = saved[6].copy()
+    grid.dominant = saved[7].copy()
+    grid.stale = saved[8].copy()
+
+
+def mark(grid):
+    grid.marks[grid.move_history_count] = save_moves(grid)
+    return grid.move_history_count
+
+
+def unplay(grid, depth):
+    for move in reversed(grid.history_ids[depth:grid.move_history_count].tolist()):
+        cell = MOVE_CELL[move]
+        for direction in range(4):
+            grid.occupied[LINE_INDEX[direction][cell]] &= ~(1 << LINE_POS[direction][cell])
+        grid.lines[MOVE_LINE[move]] &= ~(15 << MOVE_START[move])
+        grid.hash ^= MOVE_ZOBRIST[move]
+        grid.cells[MOVE_CELLS[move]] -= movetable.MOVE_CELL_BITS[move]
+        grid.cells[cell] = 0
+    grid.bounds = base.cell_bounds(grid.grid)
+    grid.move_history_count = min(grid.move_history_count, depth)
+    for marked in [marked for marked in grid.marks if marked > depth]:
+        del grid.marks[marked]
+    if depth in grid.marks:
+        restore_moves(grid, grid.marks[depth])
+    else:
+        search_moves(grid)
+
+
+def play_move(source_grid, target_grid, move_index):
+    if source_grid is not target_grid:
+        target_grid.occupied[:] = source_grid.occupied
+        target_grid.lines[:] = source_grid.lines
+        np.copyto(target_grid.cells, source_grid.cells)
+        target_grid.hash = source_grid.hash
+        target_grid.bounds = source_grid.bounds
+        target_grid.move_history_count = source_grid.move_history_count
+        target_grid.history[:target_grid.move_history_count] = source_grid.history[:target_grid.move_history_count]
+        target_grid.history_ids[:target_grid.move_history_count] = \
+            source_grid.history_ids[:target_grid.move_history_count]
+
+    if source_grid.dominator[move_index] != 999:
+        move_index = source_grid.dominator[move_index]
+
+    move = int(source_grid.ids[move_index])
+    target_grid.history[target_grid.move_history_count] = MOVE_PACKED[move]
+    target_grid.history_ids[target_grid.move_history_count] = move
+    target_grid.move_history_count += 1
+    target_grid.hash ^= MOVE_ZOBRIST[move]
+
+    if target_grid.move_history_count > MAX_HISTORY_SIZE:
+        raise ValueError("Move history storage table too small")
+
+    cell = MOVE_CELL[move]
+    if target_grid.occupied[LINE_INDEX[0][cell]] >> LINE_POS[0][cell] & 1:
+        raise ValueError("Grid contains something at the played point")
+
+    line = MOVE_LINE[move]
+    start = MOVE_START[move]
+    if (target_grid.occupied[line] >> start) & 31 != HOLE_MASK[MOVE_K[move]]:
+        raise ValueError("Grid is empty on a point supporting an alignment")
+    for direction in range(4):
+        target_grid.occupied[LINE_INDEX[direction][cell]] |= 1 << LINE_POS[direction][cell]
+    target_grid.lines[line] |= 15 << start
+    target_grid.cells[MOVE_CELLS[move]] |= movetable.MOVE_CELL_BITS[move]
+    target_grid.cells[cell] |= 1
+    target_grid.bounds = base.extend_bounds(target_grid.bounds, cell // MAX_GRID_SIZE, cell % MAX_GRID_SIZE)
+
+
+def line_code(lines, move):
+    # Endpoint bits are read transposed, exactly as the array engine does: MOVE_END_LINE and
+    # MOVE_START_LINE already point at the transposed cells.
+    bits = lines[MOVE_END_LINE[move]] >> (MOVE_END_POS[move] - 1) | lines[MOVE_START_LINE[move]] >> (MOVE_START_POS[move] - 1)
+    grid_code = MOVE_BASE_CODE[move]
+    if bits & 2:
+        grid_code += MOVE_MASK_DO[move]
+    if bits & 1:
+        grid_code += MOVE_MASK_D[move]
+    return grid_code
+
+
+def generate(grid, log_file):
+    # Codes are cached per slot and only the moves listed in grid.stale (new moves, and moves
+    # reading a cell changed since the last call) are recomputed: one vectorized pass over the
+    # cell array for large batches, table lookups for the few moves a single play invalidates.
+    index = grid.index
+    stale = [move for move in grid.stale if move in index]
+    grid.stale = set()
+    if len(stale) >= VECTOR_BATCH:
+        slots = np.array([index[move] for move in stale])
+        grid.code[slots] = movetable.move_codes(np.array(stale), grid.cells)
+    else:
+        lines = grid.lines
+        for move in stale:
+            grid.code[index[move]] = line_code(lines, move)
+
+
+def generate_reference(grid, log_file):
+    lines = grid.lines
+    grid.code[:grid.move_count] = [line_code(lines, move) for move in grid.ids[:grid.move_count].tolist()]
+
+
+def construct_game(sequence, init_grid, level, file):
+    node = pool.acquire(init_grid)
+    search_moves(node)
+    for i in range(init_grid.move_history_count, level):
+        j0 = node.index.get(packed_to_id(int(sequence[i])), 999)
+        if j0 == 999:
+            logging.error(f"Move from max_grid {i} not found. Something is wrong")
+            file.write("BEST\n")
+            base.display_sequence(sequence, file)
+            file.write("NODE\n")
+            base.display_game(node, file)
+            file.close()
+            exit(1)
+        play(node, j0)
+    return node
+
+
+pool = base.GridPool(Grid)
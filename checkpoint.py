@@ -0,0 +1,111 @@
+import os
+import time
+import logging
+import numpy as np
+
+CHECKPOINT_VERSION = 5
+
+# Run parameters that change the search trajectory: a checkpoint only resumes a run that uses the same ones.
+SETTINGS = ['level', 'iterations', 'alpha', 'seed', 'engine', 'policy', 'batch_size', 'workers', 'search',
+            'beam_width', 'temperature', 'symmetry']
+
+
+def checkpoint_path(prefix, level):
+    return f"{prefix}.level{level}.ckpt"
+
+
+def write_npz(path, arrays):
+    # Written next to the final path and renamed over it, so an interruption leaves either the
+    # previous file or the new one, never a partial file.
+    temporary = f"{path}.tmp"
+    with open(temporary, 'wb') as file:
+        np.savez_compressed(file, **arrays)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temporary, path)
+
+
+class Checkpoint:
+    # Progress of one level's run: the moves committed so far and, inside the search for the next
+    # ones, the top-level iterations done with their best sequence and adapted policy. Saved every
+    # `interval` seconds of wall time, at the end of a top-level iteration or of a committed move;
+    # without a path it is only kept in memory. No random state is stored: every search draws from a
+    # stream derived from the seed and its position in the run, so the counters are enough.
+    def __init__(self, path, interval, settings):
+        self.path = path
+        self.interval = interval
+        self.settings = settings
+        self.prefix = np.zeros(0, dtype=np.uint32)
+        self.move_counter = 0
+        self.iteration = 0
+        self.best_moves = np.zeros(0, dtype=np.uint32)
+        self.strategy = None
+        self.policy_codes = np.zeros(0, dtype=np.int64)
+        self.policy_values = np.zeros(0)
+        self.loaded = False
+        self.result = None
+        self.started = time.time()
+        self.saved_at = time.time()
+
+    def update(self, iteration, best_moves, strategy):
+        self.iteration = iteration
+        self.best_moves = best_moves
+        self.strategy = strategy
+
+    def commit(self, prefix, move_counter):
+        self.prefix = np.asarray(prefix, dtype=np.uint32)
+        self.move_counter = move_counter
+        self.iteration = 0
+        self.best_moves = np.zeros(0, dtype=np.uint32)
+        self.strategy = None
+
+    def due(self):
+        return time.time() - self.saved_at >= self.interval
+
+    def save(self):
+        if self.path is None:
+            return
+        if self.strategy is not None:
+            self.policy_codes, self.policy_values, _ = self.strategy.entries()
+        else:
+            self.policy_codes, self.policy_values = np.zeros(0, dtype=np.int64), np.zeros(0)
+        arrays = {
+            'version': np.array(CHECKPOINT_VERSION),
+            'settings': np.array([self.settings[name] for name in SETTINGS], dtype=object).astype(str),
+            'prefix': self.prefix,
+            'counters': np.array([self.move_counter, self.iteration]),
+            'elapsed': np.array(time.time() - self.started),
+            'best_moves': np.asarray(self.best_moves, dtype=np.uint32),
+            'policy_codes': self.policy_codes.astype(np.int32),
+            'policy_values': self.policy_values,
+            'finished': np.array(self.result is not None),
+        }
+        if self.result is not None:
+            arrays['result'] = np.array([self.result['moves'], self.result['signature'],
+                                         self.result['grid_signature'], self.result['time']], dtype=object).astype(str)
+        write_npz(self.path, arrays)
+        self.saved_at = time.time()
+
+    def load(self):
+        with np.load(self.path) as data:
+            state = {name: data[name] for name in data.files}
+        if int(state['version']) != CHECKPOINT_VERSION:
+            raise ValueError(f"Checkpoint {self.path} has version {int(state['version'])}, expected {CHECKPOINT_VERSION}")
+        stored = dict(zip(SETTINGS, state['settings'].tolist()))
+        for name in SETTINGS:
+            if stored[name] != str(self.settings[name]):
+                raise ValueError(f"Checkpoint {self.path} was written with {name}={stored[name]}, "
+                                 f"this run uses {name}={self.settings[name]}")
+        self.prefix = state['prefix']
+        self.move_counter, self.iteration = state['counters'].tolist()
+        self.started = time.time() - float(state['elapsed'])
+        self.best_moves = state['best_moves']
+        self.policy_codes = state['policy_codes'].astype(np.int64)
+        self.policy_values = state['policy_values']
+        self.loaded = True
+        if state['finished']:
+            moves, signature, grid_signature, elapsed = state['result'].tolist()
+            self.result = {'level': self.settings['level'], 'moves': int(moves), 'signature': signature,
+                           'grid_signature': int(grid_signature), 'time': float(elapsed)}
+        logging.info(f"Resuming from {self.path}: {len(self.prefix)} committed moves, iteration {self.iteration}, "
+                     f"{float(state['elapsed']):.2f}s elapsed")
@@ -1,6 +1 @@
-python3 ./main.py --iterations 100 --level 2 --alpha 1 --log ./logs/nrpa_100_2_1.log --result ./logs/nrpa_100_2_1.txt --data ./logs/nrpa_100_2_1.csv --seed 1
-python3 ./main.py --iterations 100 --level 2 --alpha 0.8 --log ./logs/nrpa_100_2_08.log --result ./logs/nrpa_100_2_08.txt --data ./logs/nrpa_100_2_08.csv --seed 1
-python3 ./main.py --iterations 100 --level 2 --alpha 0.6 --log ./logs/nrpa_100_2_06.log --result ./logs/nrpa_100_2_06.txt --data ./logs/nrpa_100_2_06.csv --seed 1
-python3 ./main.py --iterations 100 --level 2 --alpha 0.4 --log ./logs/nrpa_100_2_04.log --result ./logs/nrpa_100_2_04.txt --data ./logs/nrpa_100_2_04.csv --seed 1
-python3 ./main.py --iterations 100 --level 2 --alpha 0.2 --log ./logs/nrpa_100_2_02.log --result ./logs/nrpa_100_2_02.txt --data ./logs/nrpa_100_2_02.csv --seed 1
-python3 ./main.py --iterations 100 --level 2 --alpha 0.0 --log ./logs/nrpa_100_2_00.log --result ./logs/nrpa_100_2_00.txt --data ./logs/nrpa_100_2_00.csv --seed 1
\ No newline at end of file
+python3 ./sweep.py --levels 2 --alphas 1 0.8 0.6 0.4 0.2 0.0 --iterations 100 --seeds 1 --logs ./logs --output ./logs/sweep_alpha.csv
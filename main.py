@@ -1,6 +1,9 @@
+import os
+import time
 import random
 import argparse
 import csv
+import profiling
 from prettytable import PrettyTable
 from nrpa import *
 from colorama import Fore, Style, init
@@ -10,7 +13,7 @@ import logging
 init()
 
 
-def setup_logging(log_file):
+def setup_logging(log_file, console=True):
     log_colors = {
         'DEBUG': 'reset',
         'INFO': 'bold_white',
@@ -27,10 +30,15 @@ def setup_logging(log_file):
     file_handler = logging.FileHandler(log_file)
     file_handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
 
-    console_handler = logging.StreamHandler()
-    console_handler.setFormatter(formatter)
+    handlers = [file_handler]
+    if console:
+        console_handler = logging.StreamHandler()
+        console_handler.setFormatter(formatter)
+        handlers.append(console_handler)
 
-    logging.basicConfig(level=logging.INFO, handlers=[file_handler, console_handler])
+    # force replaces the handlers of an earlier call, so a process that runs several
+    # configurations (sweep.py workers) logs each one to its own file only.
+    logging.basicConfig(level=logging.INFO, handlers=handlers, force=True)
 
 
 def main():
@@ -42,30 +50,98 @@ def main():
     parser.add_argument('--data', type=str, default='data.csv', help='Path to save data for plotting')
     parser.add_argument('--level', type=int, help='Run for a single level')
     parser.add_argument('--seed', type=int, default=1, help='Random seed for reproducibility')
+    parser.add_argument('--engine', type=str, default='bitboard', choices=list(ENGINES),
+                        help='Board engine used for move generation')
+    parser.add_argument('--policy', type=str, default='dense', choices=list(POLICIES),
+                        help='Policy storage: dense arrays or sparse copy-on-write entries')
+    parser.add_argument('--random-block', type=int, default=0,
+                        help='Draw move-selection random numbers in blocks of this size (0 = one at a time)')
+    parser.add_argument('--batch', type=int, default=0,
+                        help='Run level-1 playouts in lockstep batches of this size (0 = one playout at a time)')
+    parser.add_argument('--replay-cache', type=int, default=100000,
+                        help='Positions kept by the adapt replay cache (0 disables it)')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='Worker processes for root-parallel NRPA (1 = sequential search)')
+    parser.add_argument('--checkpoint', type=str, default=None,
+                        help='Enable checkpoints, one <prefix>.level<N>.ckpt file per level')
+    parser.add_argument('--checkpoint-interval', type=float, default=300,
+                        help='Seconds of wall time between checkpoints with --checkpoint or --resume (0 disables them)')
+    parser.add_argument('--resume', action='store_true',
+                        help='Continue each level from its checkpoint; completed levels are not run again')
+    parser.add_argument('--artifacts', type=str, default=None,
+                        help='Write per-move board and policy snapshots to <prefix>.level<N>.npz instead of text dumps')
+    parser.add_argument('--search', type=str, default='nrpa', choices=SEARCHES,
+                        help='Search algorithm: nested rollout policy adaptation, Beam NRPA or Generalized NRPA')
+    parser.add_argument('--beam-width', type=int, default=4, help='Sequence/policy pairs kept per level by Beam NRPA')
+    parser.add_argument('--temperature', type=float, default=1.0, help='Softmax temperature of Generalized NRPA')
+    parser.add_argument('--symmetry', action='store_true',
+                        help='Code moves on the canonical image of the game under the start cross symmetries')
+    parser.add_argument('--archive', type=str, default=None,
+                        help='SQLite archive the final game and policy of every level are added to')
+    parser.add_argument('--warm-start', type=str, default='none', choices=WARM_STARTS,
+                        help='Start each level from the best archived policy, or from a policy adapted on the best '
+                             'archived game')
+    parser.add_argument('--time-budget', type=float, default=0,
+                        help='Seconds of wall time for the whole run, shared by the levels still to run (0 = no limit)')
+    parser.add_argument('--move-budget', type=float, default=0,
+                        help='Seconds of wall time each top-level search may take at most (0 = no limit)')
+    parser.add_argument('--profile', action='store_true',
+                        help='Time the search phases and count playouts, moves and adaptations')
 
     args = parser.parse_args()
 
     setup_logging(args.log)
+    set_engine(args.engine)
+    set_random_block(args.random_block)
+    set_policy_type(args.policy)
+    set_workers(args.workers)
+    set_batch_size(args.batch)
+    set_search(args.search, args.beam_width, args.temperature)
+    set_symmetry(args.symmetry)
+    set_replay_cache_size(args.replay_cache)
+    # Checkpoints are opt-in: a plain run leaves no .ckpt files behind.
+    checkpointing = args.checkpoint is not None or args.resume
+    set_checkpoint(args.checkpoint or args.result, args.checkpoint_interval if checkpointing else 0, args.resume)
+    set_artifacts(args.artifacts)
+    if args.warm_start != 'none' and not args.archive:
+        logging.error("--warm-start needs an --archive to start from")
+        exit(1)
+    set_archive(args.archive, args.warm_start)
+    set_move_budget(args.move_budget)
+    if args.profile:
+        enable_profiling()
 
     iterations = args.iterations
     alpha = args.alpha
     seed = args.seed
     results = []
-
-    if args.level:
-        result = run_nrpa_for_level(args.level, iterations, alpha, args.result, seed)
+    profiles = []
+    curves = []
+
+    levels = [args.level] if args.level else list(range(1, 6))
+    run_start = time.time()
+    for i, level in enumerate(levels):
+        profiling.reset()
+        budget = None
+        if args.time_budget > 0:
+            # The time left is split equally between the levels still to run, so the time a level
+            # does not use goes to the next ones.
+            budget = max(args.time_budget - (time.time() - run_start), 0) / (len(levels) - i)
+        result = run_nrpa_for_level(level, iterations, alpha, args.result, seed, budget)
         results.append(result)
-    else:
-        for level in range(1, 6):
-            result = run_nrpa_for_level(level, iterations, alpha, args.result, seed)
-            results.append(result)
+        profiles.append((level, profiling.snapshot()))
+        curves.append((level, score_curve()))
 
     with open(args.data, 'w', newline='') as data_file:
-        writer = csv.DictWriter(data_file, fieldnames=['level', 'moves', 'signature', 'time'])
+        writer = csv.DictWriter(data_file, fieldnames=['level', 'moves', 'signature', 'grid_signature', 'time'])
         writer.writeheader()
         writer.writerows(results)
 
     logging.info(f"Results saved to {args.data}")
+    if args.time_budget > 0 or args.move_budget > 0:
+        curve_path = f"{os.path.splitext(args.data)[0]}.curve.csv"
+        save_curves(curves, curve_path)
+        logging.info(f"Score-versus-time curves saved to {curve_path}")
 
     table = PrettyTable()
     table.field_names = ["Seed", "Level", "Moves", "Signature", "Time (s)", "Time per iteration (s)",
@@ -83,6 +159,30 @@ def main():
 
     logging.info("\n" + table.get_string())
 
+    if args.profile:
+        data_root = os.path.splitext(args.data)[0]
+        profiling.export(profiles, f"{data_root}.profile.json", f"{data_root}.profile.csv")
+        logging.info(f"Profile saved to {data_root}.profile.json and {data_root}.profile.csv")
+
+        table = PrettyTable()
+        table.field_names = ["Level", "Phase", "Calls", "Time (s)", "Time per call (us)", "Counter", "Value"]
+        for level, profile in profiles:
+            phases = list(profile['phases'].items())
+            counters = list(profile['counters'].items())
+            for i in range(max(len(phases), len(counters))):
+                phase, entry = phases[i] if i < len(phases) else ("", None)
+                name, value = counters[i] if i < len(counters) else ("", "")
+                table.add_row([
+                    level,
+                    phase,
+                    entry['calls'] if entry else "",
+                    f"{entry['seconds']:.3f}" if entry else "",
+                    f"{entry['seconds'] / entry['calls'] * 1e6:.1f}" if entry else "",
+                    name,
+                    value
+                ])
+        logging.info("\n" + table.get_string())
+
 
 if __name__ == "__main__":
     main()
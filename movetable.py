@@ -0,0 +1,74 @@
+import numpy as np
+
+from base import MAX_GRID_SIZE, pack_move, unpack_x, unpack_y, unpack_direction, unpack_k, zobrist_keys
+
+# Dense move ids: every (x, y, direction, k) of the board gets id ((x * 64 + y) * 4 + direction) * 5 + k,
+# so ids sort like packed moves and id // 5 is the (x, y, direction) dominator key. The tables below
+# are indexed by id and replace the decimal unpacking done by the array engine.
+MOVE_COUNT = MAX_GRID_SIZE * MAX_GRID_SIZE * 4 * 5
+DIR_X = np.array([0, 1, 1, 1])
+DIR_Y = np.array([1, 1, 0, -1])
+DIR_D = np.array([2, 4, 8, 16])
+DIR_O = np.array([32, 64, 128, 256])
+DIR_DO = np.array([34, 68, 136, 272])
+
+
+def move_id(x, y, direction, k):
+    return ((x * MAX_GRID_SIZE + y) * 4 + direction) * 5 + k
+
+
+def packed_to_id(move):
+    return move_id(unpack_x(move), unpack_y(move), unpack_direction(move), unpack_k(move))
+
+
+def base_codes(end_x1, end_y1, start_x2, start_y2):
+    # Vectorized form of the position part of the array engine's generate().
+    n1 = (MAX_GRID_SIZE - 1) * end_y1 + end_x1
+    n2 = (MAX_GRID_SIZE - 1) * start_y2 + start_x2
+    low_x = np.where(n1 < n2, end_x1, start_x2)
+    low_y = np.where(n1 < n2, end_y1, start_y2)
+    high_x = np.where(n1 < n2, start_x2, end_x1)
+    high_y = np.where(n1 < n2, start_y2, end_y1)
+    order = np.where(low_x < high_x, 0, np.where(low_x == high_x, 1, np.where(low_y > high_y, 2, 3)))
+    return 4 * np.minimum(n1, n2) + order
+
+
+_ids = np.arange(MOVE_COUNT)
+MOVE_K = _ids % 5
+MOVE_DIRECTION = _ids // 5 % 4
+MOVE_X = _ids // 20 // MAX_GRID_SIZE
+MOVE_Y = _ids // 20 % MAX_GRID_SIZE
+MOVE_CELL = _ids // 20
+MOVE_PACKED = pack_move(MOVE_X, MOVE_Y, MOVE_DIRECTION, MOVE_K)
+MOVE_ZOBRIST = zobrist_keys(MOVE_PACKED)
+
+_offsets = MOVE_K[:, None] + np.arange(-4, 1)[None, :]
+_points_x = MOVE_X[:, None] + _offsets * DIR_X[MOVE_DIRECTION][:, None]
+_points_y = MOVE_Y[:, None] + _offsets * DIR_Y[MOVE_DIRECTION][:, None]
+MOVE_VALID = ((_points_x >= 0) & (_points_x < MAX_GRID_SIZE) & (_points_y >= 0) & (_points_y < MAX_GRID_SIZE)).all(1)
+
+# Flat cell indices (x * 64 + y) of the five points, from the line start (offset k - 4) to its end
+# (offset k); -1 where a point falls outside the board.
+MOVE_CELLS = np.where(MOVE_VALID[:, None], _points_x * MAX_GRID_SIZE + _points_y, -1)
+MOVE_START_X = _points_x[:, 0]
+MOVE_START_Y = _points_y[:, 0]
+MOVE_END_X = _points_x[:, 4]
+MOVE_END_Y = _points_y[:, 4]
+MOVE_BASE_CODE = np.where(MOVE_VALID, base_codes(MOVE_END_X, MOVE_END_Y, MOVE_START_X, MOVE_START_Y), 0)
+
+MOVE_MASK_D = DIR_D[MOVE_DIRECTION]
+MOVE_MASK_O = DIR_O[MOVE_DIRECTION]
+MOVE_MASK_DO = DIR_DO[MOVE_DIRECTION]
+
+# Bits a move adds to its five cells (D on the first point, D | O inside, O on the last), and the
+# transposed endpoint cells that generate() reads, as in the array engine.
+MOVE_CELL_BITS = np.stack([MOVE_MASK_D, MOVE_MASK_DO, MOVE_MASK_DO, MOVE_MASK_DO, MOVE_MASK_O], axis=1)
+MOVE_END_READ = np.where(MOVE_VALID, MOVE_END_Y * MAX_GRID_SIZE + MOVE_END_X, 0)
+MOVE_START_READ = np.where(MOVE_VALID, MOVE_START_Y * MAX_GRID_SIZE + MOVE_START_X, 0)
+
+
+def move_codes(ids, cells):
+    # Policy codes of the moves `ids` on the flat (x * 64 + y) cell array `cells`.
+    bits = cells[MOVE_END_READ[ids]] | cells[MOVE_START_READ[ids]]
+    return MOVE_BASE_CODE[ids] + np.where(bits & MOVE_MASK_D[ids], MOVE_MASK_DO[ids], 0) + \
+        np.where(bits & MOVE_MASK_O[ids], MOVE_MASK_D[ids], 0)
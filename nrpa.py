@@ -1,62 +1,660 @@
+import os
+import csv
+import sys
 import time
 from base import *
+import base
+import archive
+import artifacts
+import batch
+import bitboard
+import checkpoint
+import profiling
+import symmetry
+from movetable import packed_to_id
 from colorama import Fore, Style
 from prettytable import PrettyTable
 from tqdm import tqdm
 import numpy as np
 import logging
-import random
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
+
+
+ENGINES = {'array': base, 'bitboard': bitboard}
+engine = bitboard
+
+
+def set_engine(name):
+    global engine
+    engine = ENGINES[name]
+
+
+# Divisor applied to exp(policy) for each move priority; 1010 moves keep their full weight.
+PRIORITY_DIVISOR = np.ones(1011)
+PRIORITY_DIVISOR[1000] = 1000
+PRIORITY_DIVISOR[1005] = 34
+
+random_block = 0
+
+
+def set_random_block(size):
+    global random_block
+    random_block = size
+
+
+class RandomStream:
+    # Uniforms of one search, from its own PCG64 generator. Each sub-search (iteration, beam entry or
+    # batch) gets the child stream of its index, seeded by the SeedSequence spawned with that key, so
+    # every search draws the same numbers whatever process runs it and whatever ran before. With a
+    # block size, uniforms are drawn that many at a time: the same values as one call per draw.
+    def __init__(self, seed, block=0):
+        self.seed = seed
+        self.generator = np.random.default_rng(seed)
+        self.block = block
+        self.values = []
+        self.position = 0
+
+    def spawn(self, key):
+        return RandomStream(np.random.SeedSequence(self.seed.entropy, spawn_key=self.seed.spawn_key + (key,)),
+                            self.block)
+
+    def uniform(self):
+        if self.block <= 0:
+            return self.generator.random()
+        if self.position == len(self.values):
+            self.values = self.generator.random(self.block).tolist()
+            self.position = 0
+        self.position += 1
+        return self.values[self.position - 1]
+
+
+def run_stream(seed, level):
+    # Stream of a run of main.py or sweep.py: one per level, then one per committed move.
+    return RandomStream(np.random.SeedSequence(seed, spawn_key=(level,)), random_block)
 
 
 class Policy:
     def __init__(self):
         self.policy = np.zeros(MAX_GRID_SIZE * MAX_GRID_SIZE * 4)
+        self.weights = np.ones(MAX_GRID_SIZE * MAX_GRID_SIZE * 4)
+
+    def copy(self):
+        new_policy = Policy.__new__(Policy)
+        new_policy.policy = self.policy.copy()
+        new_policy.weights = self.weights.copy()
+        return new_policy
+
+    def refresh(self, codes=None):
+        # weights caches exp(policy); callers that change policy entries refresh the codes they touched.
+        if codes is None:
+            self.weights = np.exp(self.policy)
+        else:
+            self.weights[codes] = np.exp(self.policy[codes])
+
+    def update(self, codes, deltas):
+        # Deltas are applied in order, so repeated codes accumulate exactly like successive += would.
+        np.add.at(self.policy, codes, deltas)
+        self.refresh(np.unique(codes))
+
+    def entries(self):
+        codes = np.flatnonzero(self.policy)
+        return codes, self.policy[codes], self.weights[codes]
+
+    @property
+    def nbytes(self):
+        return self.policy.nbytes + self.weights.nbytes
+
+
+class SparseVector:
+    def __init__(self, codes, values, default):
+        self.codes = codes
+        self.values = values
+        self.default = default
+
+    def __getitem__(self, index):
+        if len(self.codes) == 0:
+            return np.full(np.shape(index), self.default)
+        positions = np.minimum(np.searchsorted(self.codes, index), len(self.codes) - 1)
+        return np.where(self.codes[positions] == index, self.values[positions], self.default)
+
+
+class SparsePolicy:
+    # Only the entries that differ from the zero policy are stored, as sorted codes with their
+    # log-weights and cached exp. update() builds new arrays instead of writing in place, so copy()
+    # shares them and each recursion level only pays for the entries it changes.
+    def __init__(self):
+        self.codes = np.zeros(0, dtype=np.int64)
+        self.values = np.zeros(0)
+        self.exp_values = np.zeros(0)
+
+    def copy(self):
+        new_policy = SparsePolicy.__new__(SparsePolicy)
+        new_policy.codes = self.codes
+        new_policy.values = self.values
+        new_policy.exp_values = self.exp_values
+        return new_policy
+
+    @property
+    def policy(self):
+        return SparseVector(self.codes, self.values, 0.0)
+
+    @property
+    def weights(self):
+        return SparseVector(self.codes, self.exp_values, 1.0)
+
+    def update(self, codes, deltas):
+        touched = np.unique(codes)
+        values = self.policy[touched]
+        np.add.at(values, np.searchsorted(touched, codes), deltas)
+        kept = ~np.isin(self.codes, touched)
+        all_codes = np.concatenate([self.codes[kept], touched])
+        order = np.argsort(all_codes, kind='stable')
+        self.codes = all_codes[order]
+        self.values = np.concatenate([self.values[kept], values])[order]
+        self.exp_values = np.concatenate([self.exp_values[kept], np.exp(values)])[order]
+
+    def entries(self):
+        nonzero = self.values != 0
+        return self.codes[nonzero], self.values[nonzero], self.exp_values[nonzero]
+
+    @property
+    def nbytes(self):
+        return self.codes.nbytes + self.values.nbytes + self.exp_values.nbytes
+
+
+POLICIES = {'dense': Policy, 'sparse': SparsePolicy}
+policy_type = Policy
+
+
+def set_policy_type(name):
+    global policy_type
+    policy_type = POLICIES[name]
+
+
+class ReplayCache:
+    # Legal moves and their codes for the positions met while replaying best sequences, most
+    # recently used last. A position is keyed by its Zobrist hash, i.e. root hash XOR the keys of
+    # the sequence prefix played from the root, so transposed prefixes share entries.
+    def __init__(self, size):
+        self.size = size
+        self.positions = OrderedDict()
+
+    def get(self, position):
+        entry = self.positions.get(position)
+        if entry is not None:
+            self.positions.move_to_end(position)
+        return entry
+
+    def put(self, position, moves, codes, priority):
+        if self.size <= 0:
+            return
+        self.positions[position] = (moves.astype(np.uint32), codes.astype(np.int32), priority.astype(np.int16))
+        if len(self.positions) > self.size:
+            self.positions.popitem(last=False)
+
+
+replay_cache = ReplayCache(100000)
+
+
+def set_replay_cache_size(size):
+    global replay_cache
+    replay_cache = ReplayCache(size)
+
+
+batch_size = 0
+
+
+def set_batch_size(size):
+    global batch_size
+    batch_size = size
+
+
+workers = 1
+
+
+def set_workers(count):
+    global workers
+    workers = count
+
+
+SEARCHES = ['nrpa', 'beam', 'gnrpa']
+search = 'nrpa'
+beam_width = 4
+temperature = 1.0
+
+
+def set_search(name, width=4, tau=1.0):
+    # beam: Beam NRPA keeping `width` (sequence, policy) pairs per level. gnrpa: Generalized NRPA,
+    # drawing moves from exp(policy / tau + bias) and adapting on the same probabilities.
+    global search, beam_width, temperature
+    search = name
+    beam_width = width
+    temperature = tau if name == 'gnrpa' else 1.0
+
+
+symmetric = False
+
 
+def set_symmetry(enabled):
+    # With the symmetry layer, moves are coded on the canonical image of the game under the start
+    # cross's symmetries and only one move of each orbit of the game's remaining symmetries is drawn.
+    global symmetric
+    symmetric = enabled
 
-def nrpa(level, node, strategy, log_file, iterations, alpha):
+
+checkpoint_prefix = None
+checkpoint_interval = 0
+resume = False
+
+
+def set_checkpoint(prefix, interval, resume_run):
+    # interval <= 0 disables checkpoints; prefix + ".level<N>.ckpt" is the file of each level.
+    global checkpoint_prefix, checkpoint_interval, resume
+    checkpoint_prefix = prefix
+    checkpoint_interval = interval
+    resume = resume_run
+
+
+artifact_prefix = None
+
+
+def set_artifacts(prefix):
+    # With a prefix, the per-move board and policy text dumps are replaced by snapshots in
+    # prefix + ".level<N>.npz", rendered offline by render.py.
+    global artifact_prefix
+    artifact_prefix = prefix
+
+
+move_budget = 0
+deadline = None
+curve = []
+curve_best = 0
+curve_start = 0.0
+
+
+def set_move_budget(seconds):
+    # Wall time each top-level search of run_nrpa_for_level may take at most (0: no limit besides
+    # the level's budget).
+    global move_budget
+    move_budget = seconds
+
+
+def out_of_time():
+    # Anytime mode: searches finish the iteration in progress and return their best sequence once the
+    # deadline has passed. Every level runs at least one iteration, so that sequence is a full game.
+    return deadline is not None and time.time() >= deadline
+
+
+def share_deadline(searches):
+    # Deadline of the next of `searches` sub-searches still to run by a level: an equal share of the
+    # level's time left, so that every nesting level runs iterations and time a sub-search does not
+    # use goes to the next ones.
+    if deadline is None:
+        return None
+    return time.time() + max(deadline - time.time(), 0) / searches
+
+
+def track(sequence):
+    # Score-versus-time curve of the running level: one point each time a longer game is found.
+    global curve_best
+    if sequence.score > curve_best:
+        curve_best = sequence.score
+        curve.append((time.time() - curve_start, sequence.score))
+
+
+def score_curve():
+    return list(curve)
+
+
+def save_curves(curves, path):
+    # curves: (level, [(seconds, score), ...]) pairs, one CSV row per point.
+    with open(path, 'w', newline='') as file:
+        writer = csv.writer(file)
+        writer.writerow(['level', 'seconds', 'score'])
+        for level, points in curves:
+            writer.writerows([level, f"{seconds:.3f}", score] for seconds, score in points)
+
+
+WARM_STARTS = ['none', 'policy', 'sequence']
+archive_path = None
+warm_start = 'none'
+
+
+def set_archive(path, warm='none'):
+    # With a path, every level's final game and the policy its top-level search ended with are added
+    # to the archive. warm: start each level from the best archived policy, or adapt the initial
+    # policy on the best archived game, which the level then keeps unless it finds a longer one.
+    global archive_path, warm_start
+    archive_path = path
+    warm_start = warm
+
+
+def policy_from_entries(codes, values):
+    strategy = policy_type()
+    if len(codes):
+        strategy.update(codes, values)
+    return strategy
+
+
+def open_progress(level, iterations, alpha, seed):
+    if checkpoint_interval <= 0 and archive_path is None:
+        return None
+    settings = {'level': level, 'iterations': iterations, 'alpha': alpha, 'seed': seed,
+                'engine': next(name for name, module in ENGINES.items() if module is engine),
+                'policy': next(name for name, policy in POLICIES.items() if policy is policy_type),
+                'batch_size': batch_size, 'workers': workers, 'search': search, 'beam_width': beam_width,
+                'temperature': temperature, 'symmetry': symmetric}
+    if checkpoint_interval <= 0:
+        # The archive still needs the policy the top-level search ends with.
+        return checkpoint.Checkpoint(None, 0, settings)
+    progress = checkpoint.Checkpoint(checkpoint.checkpoint_path(checkpoint_prefix, level), checkpoint_interval,
+                                     settings)
+    if resume and os.path.exists(progress.path):
+        try:
+            progress.load()
+        except ValueError as error:
+            logging.error(str(error))
+            exit(1)
+    return progress
+
+
+def resume_search(progress, strategy):
+    # Iteration, best sequence and policy a top-level search starts from: where the checkpointed
+    # search stopped, or from scratch.
+    if progress is None or progress.iteration == 0:
+        return 0, Sequence([]), strategy
+    return progress.iteration, Sequence(progress.best_moves), policy_from_entries(progress.policy_codes,
+                                                                                    progress.policy_values)
+
+
+def record_progress(progress, done, best_sequence, strategy):
+    if progress is not None:
+        progress.update(done, best_sequence.moves, strategy)
+        if progress.due():
+            progress.save()
+
+
+def worker_settings():
+    engine_name = next(name for name, module in ENGINES.items() if module is engine)
+    policy_name = next(name for name, policy in POLICIES.items() if policy is policy_type)
+    return (engine_name, random_block, policy_name, batch_size, replay_cache.size,
+            profiling.enabled, search, beam_width, temperature, symmetric)
+
+
+def configure_worker(engine_name, block_size, policy_name, size, cache_size, profile, search_name='nrpa', width=4,
+                     tau=1.0, symmetry_layer=False):
+    set_search(search_name, width, tau)
+    set_symmetry(symmetry_layer)
+    set_engine(engine_name)
+    set_random_block(block_size)
+    set_policy_type(policy_name)
+    set_batch_size(size)
+    set_replay_cache_size(cache_size)
+    if profile:
+        enable_profiling()
+
+
+def count_playout(args, sequence):
+    profiling.count('playouts')
+    profiling.count('playout moves', sequence.score - args[0].move_history_count)
+
+
+def count_batch(args, sequences):
+    profiling.count('playouts', len(sequences))
+    profiling.count('playout moves', sum(sequence.score for sequence in sequences) -
+                    len(sequences) * args[0].move_history_count)
+
+
+def count_legal_moves(args, move):
+    profiling.count('legal moves', args[0].move_count)
+    profiling.count_max('legal moves max', args[0].move_count)
+
+
+def count_adapt(level, node, best_sequence):
+    if profiling.enabled:
+        profiling.count(f'adaptations level {level}')
+        profiling.count(f'adapt steps level {level}', best_sequence.score - node.move_history_count)
+
+
+def enable_profiling():
+    # Wraps the phases of the current engine, policy type and search in profiling timers. Call it
+    # after set_engine and set_policy_type; without it the search runs unwrapped.
+    if profiling.enabled:
+        return
+    profiling.enabled = True
+    for name in ['search_moves', 'search_moves_optimized', 'generate', 'play_move', 'play', 'mark', 'unplay',
+                 'construct_game']:
+        profiling.instrument(engine, name, name)
+    profiling.instrument(engine.Grid, 'copy', 'copy')
+    profiling.instrument(engine.Grid, 'copy_from', 'copy')
+    profiling.instrument(policy_type, 'copy', 'policy copy')
+    profiling.instrument(batch, 'select_moves', 'batch select_moves')
+    profiling.instrument(batch, 'play_moves', 'batch play_moves')
+    profiling.instrument(batch, 'playouts', 'batch playouts', count_batch)
+    module = sys.modules[__name__]
+    profiling.instrument(module, 'select_move', 'select_move', count_legal_moves)
+    profiling.instrument(module, 'playout', 'playout', count_playout)
+    profiling.instrument(module, 'adapt', 'adapt')
+
+
+def make_executor():
+    if workers <= 1:
+        return nullcontext()
+    return ProcessPoolExecutor(workers, initializer=configure_worker, initargs=worker_settings())
+
+
+def search_subtree(level, node, strategy, iterations, alpha, seed, stop=None):
+    # Runs in a worker process. The task's SeedSequence fully determines the search, so results do
+    # not depend on which worker picks up which task. stop is the parent's deadline.
+    global deadline
+    deadline = stop
+    profiling.reset()
+    moves = nrpa(level, node, strategy, None, iterations, alpha, RandomStream(seed, random_block)).moves
+    return moves, profiling.snapshot() if profiling.enabled else None
+
+
+def nrpa(level, node, strategy, log_file, iterations, alpha, stream, progress=None):
+    # progress is only given to the top-level call, whose iterations are checkpointed. Iteration i
+    # searches with the child stream i, so a resumed search draws what the interrupted one would have.
+    global deadline
     if level == 0:
-        return playout(node, strategy, log_file)
+        return playout(node, strategy, log_file, stream)
+    elif level == 1 and batch_size > 0:
+        return batch_nrpa(node, strategy, log_file, iterations, alpha, stream, progress)
     else:
-        best_grid = Grid()
-        best_grid.move_history_count = 0
+        start, best_sequence, strategy = resume_search(progress, strategy)
         start_time = time.time()
-        for i in range(iterations):
-            result = nrpa(level - 1, node.copy(), strategy, log_file, iterations, alpha)
-            if result.move_history_count >= best_grid.move_history_count:
-                best_grid = result.copy()
-                strategy = adapt(strategy, node, best_grid, log_file, alpha)
+        for i in range(start, iterations):
+            stop, deadline = deadline, share_deadline(iterations - i)
+            result = nrpa(level - 1, node, strategy, log_file, iterations, alpha, stream.spawn(i))
+            deadline = stop
+            track(result)
+            if result.score >= best_sequence.score:
+                best_sequence = result
+                strategy = adapt(strategy, node, best_sequence, log_file, alpha)
+                count_adapt(level, node, best_sequence)
+            record_progress(progress, i + 1, best_sequence, strategy)
+            if out_of_time():
+                break
         total_time_elapsed = time.time() - start_time
         logging.info(
             Fore.GREEN +
-            f"NRPA: COMPLETED LEVEL {level} // TOTAL MOVES: {best_grid.move_history_count} // TIME: {total_time_elapsed:.2f}s // SIGNATURE: {sign_grid(best_grid):010d} \n"
+            f"NRPA: COMPLETED LEVEL {level} // TOTAL MOVES: {best_sequence.score} // TIME: {total_time_elapsed:.2f}s // SIGNATURE: {best_sequence.signature:016x} // POLICY: {strategy.nbytes} bytes \n"
             + Style.RESET_ALL
         )
-        return best_grid
-
-
-def playout(grid, policy, log_file):
-    current_grid = grid.copy()
-    temp_grid = Grid()
-    search_moves(current_grid)
-
-    while current_grid.move_count > 0:
-        move = select_move(current_grid, policy, log_file)
-        play_move(current_grid, temp_grid, move)
-        search_moves_optimized(current_grid, temp_grid, move)
-
-        if temp_grid.move_count > 0:
-            move = select_move(temp_grid, policy, log_file)
-            play_move(temp_grid, current_grid, move)
-            search_moves_optimized(temp_grid, current_grid, move)
-        else:
-            current_grid = temp_grid.copy()
+        return best_sequence
+
+
+def select_beam(candidates):
+    # Indices of the beam_width best (sequence, policy) candidates, one per final position. The
+    # sort is stable and new sequences come first, so on equal scores they win as in nrpa's >= test.
+    selected = []
+    seen = set()
+    for i in sorted(range(len(candidates)), key=lambda i: -candidates[i][0].score):
+        sequence = candidates[i][0]
+        if sequence.score > 0 and sequence.signature not in seen:
+            seen.add(sequence.signature)
+            selected.append(i)
+            if len(selected) == beam_width:
+                break
+    return selected
+
+
+def beam_nrpa(level, node, strategy, log_file, iterations, alpha, stream):
+    # Beam NRPA: a level keeps up to beam_width (sequence, policy) pairs instead of one best
+    # sequence and its policy. Each iteration runs the level below from every pair's policy; a
+    # returned sequence that enters the beam brings that policy adapted to it. With beam_width 1
+    # this is nrpa, random streams included.
+    global deadline
+    if level == 0:
+        return [(playout(node, strategy, log_file, stream), strategy)]
+    beam = [(Sequence([]), strategy)]
+    start_time = time.time()
+    for i in range(iterations):
+        candidates = []
+        for j, (sequence, policy) in enumerate(beam):
+            stop, deadline = deadline, share_deadline((iterations - i) * len(beam) - j)
+            children = beam_nrpa(level - 1, node, policy, log_file, iterations, alpha, stream.spawn(i * beam_width + j))
+            candidates += [(result, policy) for result, _ in children]
+            deadline = stop
+        for result, _ in candidates:
+            track(result)
+        new_count = len(candidates)
+        candidates += beam
+        beam = []
+        for j in select_beam(candidates):
+            sequence, policy = candidates[j]
+            if j < new_count:
+                policy = adapt(policy, node, sequence, log_file, alpha)
+                count_adapt(level, node, sequence)
+            beam.append((sequence, policy))
+        if out_of_time():
+            break
+    total_time_elapsed = time.time() - start_time
+    logging.info(
+        Fore.GREEN +
+        f"BEAM NRPA: COMPLETED LEVEL {level} // TOTAL MOVES: {beam[0][0].score} // TIME: {total_time_elapsed:.2f}s // SIGNATURE: {beam[0][0].signature:016x} // BEAM: {len(beam)}/{beam_width} \n"
+        + Style.RESET_ALL
+    )
+    return beam
+
+
+def parallel_nrpa(level, node, strategy, log_file, iterations, alpha, stream, executor, progress=None):
+    # Root parallelization: the level - 1 searches of each round of `workers` iterations run in the
+    # pool from the same policy, then their results are merged in submission order, adapting the
+    # policy as the sequential loop does. Iteration i gets the seed of child stream i, as in nrpa.
+    done, best_sequence, strategy = resume_search(progress, strategy)
+    start_time = time.time()
+    while done < iterations:
+        seeds = [stream.spawn(i).seed for i in range(done, min(done + workers, iterations))]
+        stop = share_deadline(-(-(iterations - done) // workers))
+        futures = [executor.submit(search_subtree, level - 1, node, strategy, iterations, alpha, seed, stop)
+                   for seed in seeds]
+        for future in futures:
+            moves, profile = future.result()
+            if profile is not None:
+                profiling.merge(profile)
+            result = Sequence(moves)
+            track(result)
+            if result.score >= best_sequence.score:
+                best_sequence = result
+                strategy = adapt(strategy, node, best_sequence, log_file, alpha)
+                count_adapt(level, node, best_sequence)
+        done += len(seeds)
+        record_progress(progress, done, best_sequence, strategy)
+        if out_of_time():
+            break
+    total_time_elapsed = time.time() - start_time
+    logging.info(
+        Fore.GREEN +
+        f"NRPA: COMPLETED LEVEL {level} // TOTAL MOVES: {best_sequence.score} // TIME: {total_time_elapsed:.2f}s // SIGNATURE: {best_sequence.signature:016x} // POLICY: {strategy.nbytes} bytes // WORKERS: {workers} \n"
+        + Style.RESET_ALL
+    )
+    return best_sequence
+
+
+def batch_nrpa(node, strategy, log_file, iterations, alpha, stream, progress=None):
+    # Level 1 with lockstep playouts: each batch of up to batch_size playouts uses the policy as it
+    # was when the batch started, and the results are then adapted on in order. A batch draws from
+    # the child stream of its first iteration.
+    done, best_sequence, strategy = resume_search(progress, strategy)
+    start_time = time.time()
+    while done < iterations:
+        results = batch.playouts(node, strategy, min(batch_size, iterations - done), PRIORITY_DIVISOR,
+                                 stream.spawn(done), temperature, symmetric)
+        for result in results:
+            track(result)
+            if result.score >= best_sequence.score:
+                best_sequence = result
+                strategy = adapt(strategy, node, best_sequence, log_file, alpha)
+                count_adapt(1, node, best_sequence)
+        done += len(results)
+        record_progress(progress, done, best_sequence, strategy)
+        if out_of_time():
+            break
+    total_time_elapsed = time.time() - start_time
+    logging.info(
+        Fore.GREEN +
+        f"NRPA: COMPLETED LEVEL 1 // TOTAL MOVES: {best_sequence.score} // TIME: {total_time_elapsed:.2f}s // SIGNATURE: {best_sequence.signature:016x} // POLICY: {strategy.nbytes} bytes // BATCH: {batch_size} \n"
+        + Style.RESET_ALL
+    )
+    return best_sequence
+
+
+def playout(grid, policy, log_file, stream):
+    depth = engine.mark(grid)
+    while grid.move_count > 0:
+        engine.play(grid, select_move(grid, policy, log_file, stream))
+    sequence = Sequence(grid.history[:grid.move_history_count])
+    engine.unplay(grid, depth)
+    return sequence
+
+
+def move_weights(strategy, codes, priority):
+    # exp(policy / temperature + bias): the bias of a move is -log of its priority class divisor.
+    weights = strategy.weights[codes]
+    if temperature != 1.0:
+        weights = weights ** (1.0 / temperature)
+    return weights / PRIORITY_DIVISOR[priority]
+
+
+def policy_codes(grid):
+    # Policy codes of the legal moves, with their orbit keys and the orbit representatives under the
+    # symmetry layer (None without it).
+    count = grid.move_count
+    if not symmetric:
+        return grid.code[:count], None, None
+    codes, keys, kept = symmetry.canonical(packed_to_id(grid.moves[:count])[None], grid.grid.reshape(1, -1),
+                                           symmetry.history_group(grid.history[:grid.move_history_count]))
+    return codes[0], keys[0], kept[0]
+
+
+def select_move(grid, strategy, log_file, stream):
+    engine.generate(grid, log_file)
+    count = grid.move_count
+    codes, _, kept = policy_codes(grid)
+    weights = move_weights(strategy, codes, grid.priority[:count])
+    if kept is not None:
+        weights = weights * kept
+    total_weight = np.cumsum(weights)[-1]
+    cumulative = np.cumsum(weights / total_weight)
+    rand_num = stream.uniform()
+    move = int(np.searchsorted(cumulative, rand_num))
+    if move < count:
+        return move
 
-    return current_grid
+    logging.error(f"Problem in move selection. Random number: {rand_num:.6f}")
+    for i in range(count):
+        logging.error(
+            f"Move {i:02d} Priority: {grid.priority[i]} Code: {codes[i]} Weight: {weights[i] / total_weight:.6f}")
+    exit(1)
 
 
-def select_move(grid, strategy, log_file):
+def select_move_reference(grid, strategy, log_file, stream):
     total_weight = 0.0
-    generate(grid, log_file)
+    engine.generate(grid, log_file)
 
     for i in range(grid.move_count):
         weight = np.exp(strategy.policy[grid.code[i]])
@@ -67,7 +665,7 @@ def select_move(grid, strategy, log_file):
         else:
             total_weight += weight
 
-    rand_num = np.random.rand()
+    rand_num = stream.generator.random()
     cumulative_prob = 0.0
 
     for i in range(grid.move_count):
@@ -89,155 +687,253 @@ def select_move(grid, strategy, log_file):
     exit(1)
 
 
-def adapt(strategy, root, best_grid, log_file, alpha):
+def find_move(node, moves, move, best_sequence, step, log_file):
+    matches = np.flatnonzero(moves == move)
+    if len(matches) == 0:
+        logging.error(f"Move from best grid {step} not found. Something is wrong")
+        log_file.write(f"Move from best grid {step} not found. Something is wrong\n")
+        log_file.write("BEST\n")
+        display_sequence(best_sequence.moves, log_file)
+        log_file.write("NODE\n")
+        display_game(node, log_file)
+        log_file.close()
+        exit(1)
+    return int(matches[0])
+
+
+def replay_step(node):
+    count = node.move_count
+    codes, keys, kept = policy_codes(node)
+    if kept is None:
+        return node.moves[:count].copy(), codes.copy(), node.priority[:count].copy()
+    return keys[kept], codes[kept], node.priority[:count][kept]
+
+
+def replay(root, best_sequence, log_file):
+    # Legal moves, codes, priorities and target index at each step of best_sequence from root. Positions
+    # missing from the replay cache are reached by playing the sequence and generating codes.
+    depth = root.move_history_count
+    moves = best_sequence.moves[depth:]
+    keys = zobrist_keys(moves)
+    positions = (np.uint64(root.hash) ^ np.bitwise_xor.accumulate(keys) ^ keys).tolist()
+    targets = moves
+    if symmetric:
+        # A step holds the orbit representatives, looked up by orbit key. Its codes depend on the
+        # symmetries the moves before it left, which transposed prefixes need not share.
+        groups = symmetry.sequence_groups(root.history[:depth], moves)
+        positions = list(zip(positions, symmetry.group_key(groups)))
+        targets = symmetry.orbit_keys(groups, packed_to_id(moves.astype(np.int64)))
+    steps = [replay_cache.get(position) for position in positions]
+    if all(step is not None for step in steps):
+        return [(step_moves, codes, priority, find_move(root, step_moves, target, best_sequence, depth + i, log_file))
+                for i, ((step_moves, codes, priority), target) in enumerate(zip(steps, targets))]
+
+    engine.mark(root)
+    node = root
+    result = []
+    for i, (position, move) in enumerate(zip(positions, moves)):
+        if steps[i] is None:
+            engine.generate(node, log_file)
+            steps[i] = replay_step(node)
+            replay_cache.put(position, *steps[i])
+        step_moves, codes, priority = steps[i]
+        target = find_move(node, step_moves, targets[i], best_sequence, depth + i, log_file)
+        result.append((step_moves, codes, priority, target))
+        engine.play(node, find_move(node, node.moves[:node.move_count], move, best_sequence, depth + i, log_file))
+    engine.unplay(root, depth)
+    return result
+
+
+def adapt(strategy, root, best_sequence, log_file, alpha):
     start_time = time.time()
-    new_strategy = Policy()
-    new_strategy.policy = strategy.policy.copy()
-    node = root.copy()
-    search_moves(node)
-
-    for i in range(node.move_history_count, best_grid.move_history_count):
-        generate(node, log_file)
-        total_weight = 0.0
-        target_move_index = -1
-
-        for j in range(node.move_count):
-            total_weight += np.exp(strategy.policy[node.code[j]])
-            if node.moves[j] == best_grid.history[i]:
-                target_move_index = j
-                new_strategy.policy[node.code[j]] += alpha
-
-        if target_move_index == -1:
-            logging.error(f"Move from best grid {i} not found. Something is wrong")
-            log_file.write(f"Move from best grid {i} not found. Something is wrong\n")
-            log_file.write("BEST\n")
-            display_game(best_grid, log_file)
-            log_file.write("NODE\n")
-            display_game(node, log_file)
-            log_file.close()
-            exit(1)
-
-        for j in range(node.move_count):
-            new_strategy.policy[node.code[j]] -= alpha * np.exp(strategy.policy[node.code[j]]) / total_weight
-        play_move(node, node, target_move_index)
-        search_moves(node)
+    update_codes = []
+    update_deltas = []
+
+    # GNRPA adapts on the probabilities select_move draws from, bias and temperature included,
+    # with the gradient step alpha / temperature; NRPA on the plain policy softmax.
+    generalized = search == 'gnrpa'
+    step = alpha / temperature if generalized else alpha
+    for moves, codes, priority, target_move_index in replay(root, best_sequence, log_file):
+        weights = move_weights(strategy, codes, priority) if generalized else strategy.weights[codes]
+        total_weight = np.cumsum(weights)[-1]
+        update_codes += [codes[target_move_index:target_move_index + 1], codes]
+        update_deltas += [[step], -(step * weights / total_weight)]
+
+    new_strategy = strategy.copy()
+    if update_codes:
+        new_strategy.update(np.concatenate(update_codes), np.concatenate(update_deltas))
     logging.info(
-        f"ADAPTED STRATEGY # ALPHA: {alpha} # ADAPTED MOVES: {node.move_history_count - root.move_history_count} "
-        f"# PREV.SIG: {sign_grid(root):010d} # NEW.SIG: {sign_grid(node):010d} # TIME: {time.time() - start_time:.2f}s")
+        f"ADAPTED STRATEGY # ALPHA: {alpha} # ADAPTED MOVES: {best_sequence.score - root.move_history_count} "
+        f"# PREV.SIG: {root.hash:016x} # NEW.SIG: {best_sequence.signature:016x} # TIME: {time.time() - start_time:.2f}s")
     return new_strategy
 
 
-def generate(grid, log_file):
-    dirX = [0, 1, 1, 1]
-    dirY = [1, 1, 0, -1]
-    dirD = [2, 4, 8, 16]
-    dirO = [32, 64, 128, 256]
-    dirDO = [34, 68, 136, 272]
-
-    for i in range(grid.move_count):
-        move_x = unpack_x(grid.moves[i])
-        move_y = unpack_y(grid.moves[i])
-        move_d = unpack_direction(grid.moves[i])
-        move_k = unpack_k(grid.moves[i])
-
-        end_x1 = move_x + move_k * dirX[move_d]
-        end_y1 = move_y + move_k * dirY[move_d]
-        start_x2 = move_x + (move_k - 4) * dirX[move_d]
-        start_y2 = move_y + (move_k - 4) * dirY[move_d]
-
-        n1 = (MAX_GRID_SIZE - 1) * end_y1 + end_x1
-        n2 = (MAX_GRID_SIZE - 1) * start_y2 + start_x2
-
-        if n1 < n2:
-            grid_code = 4 * n1
-            if end_x1 < start_x2:
-                grid_code += 0
-            elif end_x1 == start_x2:
-                grid_code += 1
-            else:
-                if end_y1 > start_y2:
-                    grid_code += 2
-                else:
-                    grid_code += 3
-        else:
-            grid_code = 4 * n2
-            if start_x2 < end_x1:
-                grid_code += 0
-            elif start_x2 == end_x1:
-                grid_code += 1
-            else:
-                if start_y2 > end_y1:
-                    grid_code += 2
-                else:
-                    grid_code += 3
-
-        for direction in range(4):
-            if move_d == direction:
-                if (grid.grid[end_y1, end_x1] & dirD[direction]) or (grid.grid[start_y2, start_x2] & dirD[direction]):
-                    grid_code += dirDO[direction]
-                if (grid.grid[end_y1, end_x1] & dirO[direction]) or (grid.grid[start_y2, start_x2] & dirO[direction]):
-                    grid_code += dirD[direction]
-        grid.code[i] = grid_code
-
-
 def display_policy(strategy, log_file):
     log_file.write("STRATEGY\n")
-    for index in range(MAX_GRID_SIZE * MAX_GRID_SIZE * 4):
-        if strategy.policy[index] != 0:
-            log_file.write(
-                f"exp(policy)={np.exp(strategy.policy[index])} policy={strategy.policy[index]} code={index:05d}\n")
+    for index, value, weight in zip(*strategy.entries()):
+        log_file.write(f"exp(policy)={weight} policy={value} code={index:05d}\n")
 
 
 def sign_grid(grid):
+    # Signature used before the Zobrist hash (grid.hash), kept to compare with the historical
+    # logs/*.csv files. Cells outside the scan box are empty and add nothing.
+    cells = grid.grid
     signature = 0
-    for i in range(MAX_GRID_SIZE):
-        for j in range(MAX_GRID_SIZE):
-            signature += grid.grid[i, j] * i * j
+    min_x, max_x, min_y, max_y = scan_box(grid, 0, MAX_GRID_SIZE - 1)
+    for i in range(min_x, max_x + 1):
+        for j in range(min_y, max_y + 1):
+            signature += int(cells[i, j]) * i * j
     return signature
 
 
-def run_nrpa_for_level(level, iterations, alpha, log_file_path, seed):
-    with open(log_file_path, "w") as log_file:
-        initial_grid = Grid()
-        best_grid = Grid()
-        strategy = Policy()
-
-        random.seed(seed)
+def warm_start_level(root, strategy, log_file, alpha):
+    # Initial policy of a level and the archived game it has to beat, if any.
+    if warm_start == 'none':
+        return strategy, None
+    games = archive.Archive(archive_path)
+    # Policy codes only carry over between runs with the same symmetry setting; games always do.
+    entry = games.best(symmetric if warm_start == 'policy' else None)
+    games.close()
+    if entry is None:
+        logging.info(f"Warm start: no game in {archive_path}, starting from scratch")
+        return strategy, None
+    logging.info(f"Warm start: {warm_start} of archived game {entry['id']} ({entry['score']} moves, "
+                 f"{entry['variant']} level {entry['level']}, alpha {entry['alpha']})")
+    if warm_start == 'policy':
+        return policy_from_entries(entry['policy_codes'], entry['policy_values']), None
+    sequence = Sequence(entry['moves'])
+    return adapt(strategy, root, sequence, log_file, alpha), sequence
+
+
+def archive_game(level, iterations, alpha, seed, node, strategy):
+    games = archive.Archive(archive_path)
+    position_hash = f"{node.hash:016x}"
+    added = games.add(search, symmetric, level, alpha, iterations, seed, node.history[:node.move_history_count],
+                      position_hash, strategy)
+    games.close()
+    logging.info(f"{'Archived' if added else 'Already archived'}: {node.move_history_count} moves, "
+                 f"position {position_hash} in {archive_path}")
+
+
+def search_deadline(level_deadline):
+    # Deadline of the next top-level search. A search plays out full games, so committing its best
+    # sequence ends the level: the search gets all the level's remaining time, or the per-move budget.
+    deadlines = [limit for limit in [level_deadline, time.time() + move_budget if move_budget > 0 else None]
+                 if limit is not None]
+    return min(deadlines) if deadlines else None
+
+
+def run_nrpa_for_level(level, iterations, alpha, log_file_path, seed, budget=None):
+    # budget: seconds of wall time for the level (None: run every iteration).
+    global deadline, curve, curve_best, curve_start
+    progress = open_progress(level, iterations, alpha, seed)
+    if progress is not None and progress.result is not None:
+        logging.info(f"Level {level} already completed in {progress.path}")
+        return progress.result
+    resumed = progress is not None and progress.loaded
+
+    with open(log_file_path, "a" if resumed else "w") as log_file, make_executor() as executor:
+        initial_grid = engine.Grid()
+        strategy = policy_type()
+
+        # Top-level search m draws from child stream m of the level's stream.
+        stream = run_stream(seed, level)
         logging.info(f"Seed: {seed}")
 
-        initialize_game(initial_grid)
-        current_node = initial_grid.copy()
-        search_moves(current_node)
+        engine.initialize_game(initial_grid)
+        current_node = engine.pool.acquire(initial_grid)
+        engine.search_moves(current_node)
+        if symmetric:
+            kept = policy_codes(current_node)[2]
+            logging.info(f"Symmetry layer: {kept.sum()} of {len(kept)} first moves are distinct up to symmetry")
         logging.info(
             Fore.LIGHTYELLOW_EX + f"Starting NRPA with level={level}, iterations={iterations}, alpha={alpha}" + Style.RESET_ALL)
         start_time = time.time()
 
-        best_grid.move_history_count = 0
+        writer = None
+        if artifact_prefix:
+            writer = artifacts.ArtifactWriter(artifacts.artifact_path(artifact_prefix, level), level, iterations, alpha,
+                                              seed)
+        best_sequence = Sequence([])
         move_counter = 0
+        if resumed:
+            next_node = engine.construct_game(progress.prefix, current_node, len(progress.prefix), log_file)
+            engine.pool.release(current_node)
+            current_node = next_node
+            engine.search_moves(current_node)
+            start_time = progress.started
+            best_sequence = Sequence(progress.prefix)
+            move_counter = progress.move_counter
+        curve, curve_best, curve_start = [], best_sequence.score, start_time
+        level_deadline = None
+        if budget is not None:
+            level_deadline = start_time + budget
+            logging.info(f"Time budget: {budget:.2f}s for level {level}, "
+                         f"{max(level_deadline - time.time(), 0):.2f}s left")
+        # A resumed level continues from its checkpointed policy, which already holds the warm start.
+        strategy, warm_sequence = warm_start_level(current_node, strategy, log_file, alpha) if not resumed else \
+            (strategy, None)
+        if warm_sequence is not None:
+            track(warm_sequence)
+        learned = strategy
 
         while current_node.move_count > 0:
-            best_grid = nrpa(level, current_node, strategy, log_file, iterations, alpha)
+            deadline = search_deadline(level_deadline)
+            if search == 'beam':
+                best_sequence, learned = beam_nrpa(level, current_node, strategy, log_file, iterations, alpha,
+                                                    stream.spawn(move_counter))[0]
+            elif executor is None:
+                best_sequence = nrpa(level, current_node, strategy, log_file, iterations, alpha, stream.spawn(move_counter),
+                                     progress)
+            else:
+                best_sequence = parallel_nrpa(level, current_node, strategy, log_file, iterations, alpha,
+                                              stream.spawn(move_counter), executor, progress)
+            if search != 'beam' and progress is not None and progress.strategy is not None:
+                learned = progress.strategy
+            if warm_sequence is not None and warm_sequence.score > best_sequence.score:
+                logging.info(f"Keeping the archived game of {warm_sequence.score} moves over the "
+                             f"{best_sequence.score} moves found")
+                best_sequence = warm_sequence
+            warm_sequence = None
+            deadline = None
             log_file.write(f"End recursion level {level}, iterations={iterations}\n")
-            current_node = construct_game(best_grid, initial_grid, best_grid.move_history_count, log_file)
-            search_moves(current_node)
+            # The best sequence extends current_node's game, so only its new moves are replayed.
+            next_node = engine.construct_game(best_sequence.moves, current_node, best_sequence.score, log_file)
+            engine.pool.release(current_node)
+            current_node = next_node
+            engine.search_moves(current_node)
 
             move_counter += 1
             logging.info(
-                f"Move {move_counter} completed ## Total moves: {best_grid.move_history_count} ## Time elapsed: {time.time() - start_time:.2f}s")
+                f"Move {move_counter} completed ## Total moves: {best_sequence.score} ## Time elapsed: {time.time() - start_time:.2f}s")
 
-            log_file.write("Best Grid\n")
-            display_game(best_grid, log_file)
-            display_policy(strategy, log_file)
+            if writer is not None:
+                writer.snapshot(current_node.history[:current_node.move_history_count], strategy)
+            else:
+                log_file.write("Best Grid\n")
+                display_game(current_node, log_file)
+                display_policy(strategy, log_file)
+            if progress is not None:
+                progress.commit(current_node.history[:current_node.move_history_count], move_counter)
+                if progress.due():
+                    progress.save()
 
         end_time = time.time()
         execution_time = end_time - start_time
 
-        display_game(best_grid, log_file)
+        display_game(current_node, log_file)
         display_policy(strategy, log_file)
 
-        return {
+        result = {
             'level': level,
-            'moves': best_grid.move_history_count,
-            'signature': sign_grid(best_grid),
+            'moves': best_sequence.score,
+            'signature': f"{current_node.hash:016x}",
+            'grid_signature': sign_grid(current_node),
             'time': execution_time
         }
+        if progress is not None:
+            progress.result = result
+            progress.save()
+        if archive_path:
+            archive_game(level, iterations, alpha, seed, current_node, learned)
+        return result
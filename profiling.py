@@ -0,0 +1,72 @@
+import csv
+import json
+import time
+from collections import defaultdict
+
+# Opt-in phase timers and counters. instrument() replaces a function by a timing wrapper, so
+# nothing is measured, and nothing costs, until instrumentation is installed. Phase times are
+# inclusive: a phase that calls another one (adapt replays moves with play) includes its time.
+enabled = False
+timers = defaultdict(float)
+calls = defaultdict(int)
+counters = defaultdict(int)
+
+
+def instrument(owner, name, phase, counter=None):
+    function = getattr(owner, name)
+
+    def wrapper(*args):
+        start = time.perf_counter()
+        result = function(*args)
+        timers[phase] += time.perf_counter() - start
+        calls[phase] += 1
+        if counter is not None:
+            counter(args, result)
+        return result
+
+    setattr(owner, name, wrapper)
+
+
+def count(name, value=1):
+    counters[name] += value
+
+
+def count_max(name, value):
+    counters[name] = max(counters[name], value)
+
+
+def reset():
+    timers.clear()
+    calls.clear()
+    counters.clear()
+
+
+def snapshot():
+    return {'phases': {phase: {'calls': calls[phase], 'seconds': timers[phase]} for phase in sorted(timers)},
+            'counters': dict(sorted(counters.items()))}
+
+
+def merge(profile):
+    # Adds the snapshot of another process (a root-parallel worker) to this one.
+    for phase, entry in profile['phases'].items():
+        timers[phase] += entry['seconds']
+        calls[phase] += entry['calls']
+    for name, value in profile['counters'].items():
+        if name.endswith(' max'):
+            count_max(name, value)
+        else:
+            count(name, value)
+
+
+def export(profiles, json_path, csv_path):
+    # profiles: (level, snapshot) pairs, written as one JSON document and as CSV rows.
+    with open(json_path, 'w') as file:
+        json.dump([dict(level=level, **profile) for level, profile in profiles], file, indent=2)
+    with open(csv_path, 'w', newline='') as file:
+        writer = csv.DictWriter(file, fieldnames=['level', 'name', 'calls', 'seconds', 'value'])
+        writer.writeheader()
+        for level, profile in profiles:
+            for phase, entry in profile['phases'].items():
+                writer.writerow({'level': level, 'name': phase, 'calls': entry['calls'], 'seconds': entry['seconds']})
+            for name, value in profile['counters'].items():
+                writer.writerow({'level': level, 'name': name, 'value': value})
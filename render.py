@@ -0,0 +1,35 @@
+import sys
+import argparse
+from contextlib import nullcontext
+import artifacts
+import nrpa
+from nrpa import ENGINES, display_game, display_policy, policy_from_entries
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Rebuild the board and policy listing of a run artifact')
+    parser.add_argument('path', type=str, help='Artifact file written by main.py --artifacts')
+    parser.add_argument('--snapshot', type=int, default=-1, help='Snapshot to render (default: the last one)')
+    parser.add_argument('--output', type=str, default=None, help='Output file (default: standard output)')
+    parser.add_argument('--engine', type=str, default='bitboard', choices=list(ENGINES),
+                        help='Board engine used to replay the game')
+    args = parser.parse_args()
+
+    nrpa.set_engine(args.engine)
+    engine = nrpa.engine
+    moves, codes, values = artifacts.load_snapshots(args.path)[args.snapshot]
+    root = engine.Grid()
+    engine.initialize_game(root)
+    engine.search_moves(root)
+
+    with open(args.output, 'w') if args.output else nullcontext(sys.stdout) as file:
+        grid = engine.construct_game(moves, root, len(moves), file)
+        engine.search_moves(grid)
+        # Same text as the per-move dump of run_nrpa_for_level without --artifacts.
+        file.write("Best Grid\n")
+        display_game(grid, file)
+        display_policy(policy_from_entries(codes, values), file)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,146 @@
+import os
+import csv
+import time
+import argparse
+import itertools
+import logging
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from prettytable import PrettyTable
+import nrpa
+from main import setup_logging
+
+RUN_FIELDS = ['level', 'moves', 'signature', 'grid_signature', 'time']
+SWEEP_FIELDS = ['level', 'alpha', 'iterations', 'seed', 'moves', 'signature', 'grid_signature', 'time']
+
+
+def alpha_tag(alpha):
+    # Alpha as exp.sh wrote it, without the point: 1 for 1, 08 for 0.8 and 00 for 0.0.
+    text = f'{alpha:g}'
+    if '.' not in text and alpha < 1:
+        text += '.0'
+    return text.replace('.', '')
+
+
+def run_name(level, alpha, iterations, seed):
+    # Same names as the runs of exp.sh (nrpa_100_2_08 for level 2, alpha 0.8, 100 iterations, seed 1).
+    name = f"nrpa_{iterations}_{level}_{alpha_tag(alpha)}"
+    return name if seed == 1 else f"{name}_s{seed}"
+
+
+def run_names(level, alpha, iterations, seed):
+    # run_name, then the spelling of the results kept in logs/ for alphas like 0.0 (nrpa_100_2_0).
+    names = [run_name(level, alpha, iterations, seed)]
+    legacy = f"nrpa_{iterations}_{level}_{f'{alpha:g}'.replace('.', '')}"
+    legacy = legacy if seed == 1 else f"{legacy}_s{seed}"
+    return names if legacy in names else names + [legacy]
+
+
+def read_result(path, level):
+    # Result row of a finished run, or None when there is none or it cannot be read. Files written
+    # before the Zobrist hash hold the full-board signature in their signature column.
+    if not os.path.exists(path):
+        return None
+    with open(path, newline='') as file:
+        for row in csv.DictReader(file):
+            if row.get('level') == str(level):
+                try:
+                    int(row['moves'])
+                    float(row['time'])
+                except (KeyError, TypeError, ValueError):
+                    return None
+                if 'grid_signature' not in row:
+                    row['grid_signature'], row['signature'] = row.get('signature', ''), ''
+                return {field: row.get(field, '') for field in RUN_FIELDS}
+    return None
+
+
+def run_configuration(configuration, logs_dir, budget):
+    # Runs in a pool worker, one configuration at a time, logging to the run's own file only.
+    level, alpha, iterations, seed = configuration
+    path = os.path.join(logs_dir, run_name(level, alpha, iterations, seed))
+    setup_logging(f"{path}.log", console=False)
+    result = nrpa.run_nrpa_for_level(level, iterations, alpha, f"{path}.txt", seed, budget)
+    if budget is not None:
+        nrpa.save_curves([(level, nrpa.score_curve())], f"{path}.curve.csv")
+    with open(f"{path}.csv", 'w', newline='') as data_file:
+        writer = csv.DictWriter(data_file, fieldnames=RUN_FIELDS)
+        writer.writeheader()
+        writer.writerow(result)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run a grid of NRPA configurations over a process pool')
+    parser.add_argument('--levels', type=int, nargs='+', default=[1, 2, 3], help='Nesting levels')
+    parser.add_argument('--alphas', type=float, nargs='+', default=[1.0], help='Learning rates')
+    parser.add_argument('--iterations', type=int, nargs='+', default=[100], help='Iterations per level')
+    parser.add_argument('--seeds', type=int, nargs='+', default=[1], help='Random seeds')
+    parser.add_argument('--processes', type=int, default=os.cpu_count(), help='Runs executed at the same time')
+    parser.add_argument('--logs', type=str, default='./logs', help='Directory of the per-run .log, .txt and .csv files')
+    parser.add_argument('--output', type=str, default='./logs/sweep.csv', help='Merged results table')
+    parser.add_argument('--time-budget', type=float, default=0,
+                        help='Seconds of wall time per run, saving its score-versus-time curve (0 = no limit)')
+    parser.add_argument('--force', action='store_true', help='Run configurations that already have results again')
+    parser.add_argument('--engine', type=str, default='bitboard', choices=list(nrpa.ENGINES),
+                        help='Board engine used for move generation')
+    parser.add_argument('--policy', type=str, default='dense', choices=list(nrpa.POLICIES),
+                        help='Policy storage: dense arrays or sparse copy-on-write entries')
+    parser.add_argument('--random-block', type=int, default=0,
+                        help='Draw move-selection random numbers in blocks of this size (0 = one at a time)')
+    parser.add_argument('--batch', type=int, default=0,
+                        help='Run level-1 playouts in lockstep batches of this size (0 = one playout at a time)')
+    parser.add_argument('--replay-cache', type=int, default=100000,
+                        help='Positions kept by the adapt replay cache (0 disables it)')
+    args = parser.parse_args()
+
+    os.makedirs(args.logs, exist_ok=True)
+    setup_logging(os.path.join(args.logs, 'sweep.log'))
+
+    configurations = list(itertools.product(args.levels, args.alphas, args.iterations, args.seeds))
+    results = {}
+    pending = []
+    for configuration in configurations:
+        level, alpha, iterations, seed = configuration
+        result = next((result for result in (read_result(os.path.join(args.logs, f"{name}.csv"), level)
+                                             for name in run_names(level, alpha, iterations, seed))
+                       if result is not None), None)
+        if result is not None and not args.force:
+            logging.info(f"Skipping level={level} alpha={alpha} iterations={iterations} seed={seed}: results exist")
+            results[configuration] = result
+        else:
+            pending.append(configuration)
+    # A level-L run costs about iterations ** L playouts; the longest runs start first so that
+    # the short ones fill the pool around them.
+    pending.sort(key=lambda configuration: configuration[2] ** configuration[0], reverse=True)
+
+    start_time = time.time()
+    settings = (args.engine, args.random_block, args.policy, args.batch, args.replay_cache, False)
+    with ProcessPoolExecutor(args.processes, initializer=nrpa.configure_worker, initargs=settings) as executor:
+        budget = args.time_budget if args.time_budget > 0 else None
+        futures = {executor.submit(run_configuration, configuration, args.logs, budget): configuration
+                   for configuration in pending}
+        for future in as_completed(futures):
+            level, alpha, iterations, seed = configuration = futures[future]
+            results[configuration] = future.result()
+            logging.info(f"Finished level={level} alpha={alpha} iterations={iterations} seed={seed}: "
+                         f"{results[configuration]['moves']} moves in {float(results[configuration]['time']):.2f}s "
+                         f"({len(results)}/{len(configurations)}, {time.time() - start_time:.2f}s elapsed)")
+
+    rows = [dict(zip(['level', 'alpha', 'iterations', 'seed'], configuration), **results[configuration])
+            for configuration in configurations]
+    with open(args.output, 'w', newline='') as data_file:
+        writer = csv.DictWriter(data_file, fieldnames=SWEEP_FIELDS)
+        writer.writeheader()
+        writer.writerows(rows)
+    logging.info(f"Results saved to {args.output}")
+
+    table = PrettyTable()
+    table.field_names = ["Level", "Alpha", "Iterations", "Seed", "Moves", "Signature", "Time (s)"]
+    for row in rows:
+        table.add_row([row['level'], row['alpha'], row['iterations'], row['seed'], row['moves'], row['signature'],
+                       f"{float(row['time']):.2f}"])
+    logging.info("\n" + table.get_string())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+import numpy as np
+
+import movetable
+from base import MAX_GRID_SIZE
+from movetable import MOVE_COUNT, move_id, packed_to_id
+
+# The start cross of initialize_game is symmetric under the eight rotations and reflections of the
+# square around its centre (18.5, 18.5). Transform t maps (x, y) to (c + a (x - c) + b (y - c),
+# c + e (x - c) + f (y - c)) for its row (a, b, e, f) of TRANSFORMS; the identity comes first.
+CENTRE_2 = 37
+TRANSFORMS = np.array([[1, 0, 0, 1], [0, -1, 1, 0], [-1, 0, 0, -1], [0, 1, -1, 0],
+                       [1, 0, 0, -1], [-1, 0, 0, 1], [0, 1, 1, 0], [0, -1, -1, 0]])
+ALL = np.ones((1, len(TRANSFORMS)), dtype=bool)
+GROUP_BITS = 1 << np.arange(len(TRANSFORMS))
+NO_KEY = MOVE_COUNT + 1
+NO_CODE = np.iinfo(np.int32).max
+CELL_COUNT = MAX_GRID_SIZE * MAX_GRID_SIZE
+
+
+def extend(table, value):
+    return np.concatenate([table, np.full(table.shape[:-1] + (1,), value, dtype=table.dtype)], axis=-1)
+
+
+def image_tables():
+    # Image of every move id under every transform, and whether the transform reverses its line
+    # (the image point is then k' = 4 - k along the image direction). Moves whose image leaves the
+    # board, more than 18 points from the centre on the high side, are left in place.
+    images = np.tile(np.arange(MOVE_COUNT), (len(TRANSFORMS), 1))
+    reversed_lines = np.zeros(images.shape, dtype=bool)
+    offset_x = 2 * movetable.MOVE_X - CENTRE_2
+    offset_y = 2 * movetable.MOVE_Y - CENTRE_2
+    for t, (a, b, e, f) in enumerate(TRANSFORMS):
+        x = (a * offset_x + b * offset_y + CENTRE_2) // 2
+        y = (e * offset_x + f * offset_y + CENTRE_2) // 2
+        step_x = a * movetable.DIR_X + b * movetable.DIR_Y
+        step_y = e * movetable.DIR_X + f * movetable.DIR_Y
+        direction = np.zeros(4, dtype=int)
+        flipped = np.zeros(4, dtype=bool)
+        for d in range(4):
+            for image in range(4):
+                for sign in [1, -1]:
+                    if (sign * step_x[d], sign * step_y[d]) == (movetable.DIR_X[image], movetable.DIR_Y[image]):
+                        direction[d], flipped[d] = image, sign < 0
+        flip = flipped[movetable.MOVE_DIRECTION]
+        k = np.where(flip, 4 - movetable.MOVE_K, movetable.MOVE_K)
+        on_board = (x >= 0) & (x < MAX_GRID_SIZE) & (y >= 0) & (y < MAX_GRID_SIZE)
+        ids = move_id(np.where(on_board, x, 0), np.where(on_board, y, 0), direction[movetable.MOVE_DIRECTION], k)
+        mapped = on_board & movetable.MOVE_VALID & movetable.MOVE_VALID[ids]
+        images[t] = np.where(mapped, ids, images[t])
+        reversed_lines[t] = mapped & flip
+    return images, reversed_lines
+
+
+# Tables have an extra column at MOVE_COUNT for the padding of the batch engine's move arrays.
+_images, _reversed = image_tables()
+IMAGE = extend(_images, MOVE_COUNT).astype(np.int32)
+REVERSED = extend(_reversed, False)
+BASE_CODE = extend(movetable.MOVE_BASE_CODE, 0)
+MASK_D = extend(movetable.MOVE_MASK_D, 0)
+MASK_O = extend(movetable.MOVE_MASK_O, 0)
+MASK_DO = extend(movetable.MOVE_MASK_DO, 0)
+START = extend(np.where(movetable.MOVE_VALID, movetable.MOVE_CELLS[:, 0], 0), CELL_COUNT)
+END = extend(np.where(movetable.MOVE_VALID, movetable.MOVE_CELLS[:, 4], 0), CELL_COUNT)
+
+
+def refine(groups, ids):
+    # groups: (boards, 8) transforms that map each board's history to its smallest image, move by
+    # move. Keeps those that also map the next move `ids` (one per board) to its smallest image.
+    images = np.where(groups.T, IMAGE[:, ids], NO_KEY)
+    return groups & (images == images.min(0)).T
+
+
+def history_group(history):
+    # Transforms of a game from the start cross, as a (1, 8) row; usually a single one after the
+    # first moves. Called once per selected move, so the refinement runs on scalars.
+    group = range(len(TRANSFORMS))
+    for move in history:
+        if len(group) == 1:
+            break
+        move = packed_to_id(int(move))
+        images = [int(IMAGE[t, move]) for t in group]
+        group = [t for t, image in zip(group, images) if image == min(images)]
+    row = np.zeros((1, len(TRANSFORMS)), dtype=bool)
+    row[0, group] = True
+    return row
+
+
+def sequence_groups(history, moves):
+    # Group before each of `moves` played after `history`, as a (len(moves), 8) array.
+    group = history_group(history)
+    groups = np.empty((len(moves), len(TRANSFORMS)), dtype=bool)
+    for i, move in enumerate(packed_to_id(np.asarray(moves, dtype=np.int64))):
+        groups[i] = group[0]
+        if group.sum() > 1:
+            group = refine(group, [move])
+    return groups
+
+
+def group_key(groups):
+    return (groups @ GROUP_BITS).tolist()
+
+
+def orbit_keys(groups, ids):
+    # Smallest image of each move over its board's transforms: equal for moves a symmetry of the
+    # board maps onto each other, and for a move and its image in the transformed game.
+    return np.where(groups.T, IMAGE[:, ids], NO_KEY).min(0)
+
+
+def image_codes(images, reverse, has_d, has_o):
+    starts = np.where(reverse, has_o, has_d)
+    ends = np.where(reverse, has_d, has_o)
+    return BASE_CODE[images] + np.where(starts, MASK_DO[images], 0) + np.where(ends, MASK_D[images], 0)
+
+
+def canonical(ids, cells, groups):
+    # Codes, orbit keys and orbit representatives of the moves `ids` (boards x moves) on the flat
+    # x * 64 + y cell rows `cells`. The code of a move is the smallest code of its images over the
+    # board's transforms: the segment code of the image move plus the start (D) and end (O) bits of
+    # its direction at the two endpoints, swapped when the transform reverses the line. The
+    # endpoints are read as they are, not transposed like generate does, since the transposed read
+    # does not commute with the rotations. The representative of an orbit is the move mapped to
+    # the orbit key by the board's first transform.
+    rows = np.arange(len(cells))[:, None]
+    bits = cells[rows, END[ids]] | cells[rows, START[ids]]
+    has_d = (bits & MASK_D[ids]) != 0
+    has_o = (bits & MASK_O[ids]) != 0
+    if groups.sum() == len(groups):
+        # One transform per board, as soon as the first moves break the symmetry: every move is its
+        # own orbit.
+        transform = groups.argmax(1)[:, None]
+        images = IMAGE[transform, ids]
+        return image_codes(images, REVERSED[transform, ids], has_d, has_o), images, np.ones(ids.shape, dtype=bool)
+    images = IMAGE[:, ids]
+    codes = image_codes(images, REVERSED[:, ids], has_d, has_o)
+    selected = groups.T[:, :, None]
+    keys = np.where(selected, images, NO_KEY).min(0)
+    kept = images[groups.argmax(1)[:, None], rows, np.arange(ids.shape[1])] == keys
+    return np.where(selected, codes, NO_CODE).min(0), keys, kept